@@ -9,10 +9,13 @@ from ....schemas import (
     AlertRuleResponse,
     AlertEventResponse,
 )
-from ....services import get_current_user
+from ....services import get_current_user, mark_alert_rules_changed
 
 router = APIRouter()
 
+# single: the rule's server only; vector: every server whose job/instance labels appear in the result
+EVALUATION_MODES = ["single", "vector"]
+
 
 # Alert Rules endpoints
 @router.get("/rules/", response_model=List[AlertRuleResponse])
@@ -42,14 +45,28 @@ async def create_alert_rule(
     """
     Create a new alert rule.
     """
-    # Verify server exists
-    server = db.query(Server).filter(Server.id == rule_in.server_id).first()
-    if not server:
+    # Validate evaluation mode
+    if rule_in.evaluation_mode not in EVALUATION_MODES:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Server not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid evaluation mode. Must be one of: {', '.join(EVALUATION_MODES)}"
         )
 
+    if rule_in.server_id is None:
+        if rule_in.evaluation_mode == "single":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="server_id is required for single-server rules"
+            )
+    else:
+        # Verify server exists
+        server = db.query(Server).filter(Server.id == rule_in.server_id).first()
+        if not server:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Server not found"
+            )
+
     # Validate comparison operator
     valid_comparisons = [">", "<", ">=", "<=", "==", "!="]
     if rule_in.comparison not in valid_comparisons:
@@ -58,10 +75,17 @@ async def create_alert_rule(
             detail=f"Invalid comparison operator. Must be one of: {', '.join(valid_comparisons)}"
         )
 
+    if rule_in.eval_interval_sec is not None and rule_in.eval_interval_sec <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="eval_interval_sec must be positive"
+        )
+
     rule = AlertRule(**rule_in.dict())
     db.add(rule)
     db.commit()
     db.refresh(rule)
+    await mark_alert_rules_changed()
     return rule
 
 
@@ -111,11 +135,30 @@ async def update_alert_rule(
                 detail=f"Invalid comparison operator. Must be one of: {', '.join(valid_comparisons)}"
             )
 
+    if "evaluation_mode" in update_data:
+        if update_data["evaluation_mode"] not in EVALUATION_MODES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid evaluation mode. Must be one of: {', '.join(EVALUATION_MODES)}"
+            )
+        if update_data["evaluation_mode"] == "single" and rule.server_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="server_id is required for single-server rules"
+            )
+
+    if update_data.get("eval_interval_sec") is not None and update_data["eval_interval_sec"] <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="eval_interval_sec must be positive"
+        )
+
     for field, value in update_data.items():
         setattr(rule, field, value)
 
     db.commit()
     db.refresh(rule)
+    await mark_alert_rules_changed()
     return rule
 
 
@@ -137,6 +180,7 @@ async def delete_alert_rule(
 
     db.delete(rule)
     db.commit()
+    await mark_alert_rules_changed()
     return None
 
 
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 from ....db import get_db
 from ....models import Server, User
-from ....schemas import MetricSummary
-from ....services import get_current_user, prometheus_service
+from ....schemas import MetricSummary, MetricHistory, MetricSeries, RecentMetrics
+from ....services import get_current_user, prometheus_service, recent_samples
+from ....services.prometheus_service import SERVER_METRIC_QUERIES
+from ....services.series import MSGPACK_MEDIA_TYPE, accepts_msgpack, pack
 
 router = APIRouter()
 
@@ -31,7 +35,7 @@ async def get_server_metrics_summary(
         )
 
     # Get metrics from Prometheus
-    metrics = await prometheus_service.get_server_metrics(
+    metrics, errors = await prometheus_service.get_server_metrics(
         job_name=server.job_name,
         instance=server.instance
     )
@@ -39,5 +43,174 @@ async def get_server_metrics_summary(
     return MetricSummary(
         server_id=server.id,
         server_name=server.name,
-        metrics=metrics
+        metrics=metrics,
+        errors=errors
     )
+
+
+def _to_unix(value: datetime) -> float:
+    """
+    Convert a datetime to a unix timestamp, treating naive values as UTC.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+@router.get(
+    "/servers/{server_id}/history",
+    response_model=MetricHistory,
+    responses={200: {"content": {MSGPACK_MEDIA_TYPE: {}}}},
+)
+async def get_server_metric_history(
+    request: Request,
+    server_id: int,
+    metric: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: int = Query(500, ge=2, le=11000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get the history of one metric for a server (defaults to the last hour).
+    The step is chosen so that no series has more than max_points samples.
+
+    Send "Accept: application/x-msgpack" for a compact response where each
+    series carries its timestamps and values as little-endian float64 arrays.
+    """
+    if metric not in SERVER_METRIC_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid metric. Must be one of: {', '.join(SERVER_METRIC_QUERIES)}"
+        )
+
+    end_ts = _to_unix(end) if end else datetime.now(timezone.utc).timestamp()
+    start_ts = _to_unix(start) if start else end_ts - timedelta(hours=1).total_seconds()
+    if start_ts >= end_ts:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end"
+        )
+
+    server = db.query(Server).filter(Server.id == server_id).first()
+    if not server:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Server not found"
+        )
+
+    if not server.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Server is not active"
+        )
+
+    series, step = await prometheus_service.get_server_metric_history(
+        job_name=server.job_name,
+        instance=server.instance,
+        metric=metric,
+        start=start_ts,
+        end=end_ts,
+        max_points=max_points
+    )
+    if series is None:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to query Prometheus"
+        )
+
+    if accepts_msgpack(request.headers.get("accept")):
+        payload = {
+            "server_id": server.id,
+            "server_name": server.name,
+            "metric": metric,
+            "start": start_ts,
+            "end": end_ts,
+            "step": step,
+            "series": [item.to_msgpack_dict() for item in series],
+        }
+        return Response(content=pack(payload), media_type=MSGPACK_MEDIA_TYPE)
+
+    return MetricHistory(
+        server_id=server.id,
+        server_name=server.name,
+        metric=metric,
+        start=start_ts,
+        end=end_ts,
+        step=step,
+        series=[MetricSeries(labels=item.labels, values=item.to_pairs()) for item in series]
+    )
+
+
+@router.get(
+    "/servers/{server_id}/recent",
+    response_model=RecentMetrics,
+    responses={200: {"content": {MSGPACK_MEDIA_TYPE: {}}}},
+)
+async def get_server_recent_metrics(
+    request: Request,
+    server_id: int,
+    seconds: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get the recently polled metrics of a server from the in-memory buffer
+    that feeds live streams, without querying Prometheus. Covers the last
+    `seconds` (default and maximum: WS_BACKFILL_SECONDS); empty when the
+    server has not been streamed recently.
+
+    Send "Accept: application/x-msgpack" to get the timestamps and each
+    metric as little-endian float64 arrays.
+    """
+    server = db.query(Server).filter(Server.id == server_id).first()
+    if not server:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Server not found"
+        )
+
+    since = datetime.now(timezone.utc).timestamp() - seconds if seconds else None
+    binary = accepts_msgpack(request.headers.get("accept"))
+    payload = recent_samples.get(server.id, since=since, binary=binary)
+    payload["server_name"] = server.name
+
+    if binary:
+        return Response(content=pack(payload), media_type=MSGPACK_MEDIA_TYPE)
+
+    return RecentMetrics(**payload)
+
+
+@router.get("/fleet/summary", response_model=List[MetricSummary])
+async def get_fleet_metrics_summary(
+    server_ids: Optional[List[int]] = Query(None),
+    active_only: bool = True,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get metrics summary for many servers with one Prometheus query per metric.
+    """
+    query = db.query(Server)
+    if server_ids:
+        query = query.filter(Server.id.in_(server_ids))
+    if active_only:
+        query = query.filter(Server.is_active == True)
+    servers = query.order_by(Server.id).all()
+
+    if not servers:
+        return []
+
+    # Get metrics for every instance and join them to servers by (job, instance)
+    fleet_metrics, errors = await prometheus_service.get_fleet_metrics()
+
+    return [
+        MetricSummary(
+            server_id=server.id,
+            server_name=server.name,
+            metrics=fleet_metrics.get((server.job_name, server.instance), {}),
+            errors=errors
+        )
+        for server in servers
+    ]
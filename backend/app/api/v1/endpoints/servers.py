@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from ....db import get_db
 from ....models import Server, User
 from ....schemas import ServerCreate, ServerUpdate, ServerResponse
-from ....services import get_current_user
+from ....services import get_current_user, server_registry
 
 router = APIRouter()
 
@@ -80,6 +80,7 @@ async def update_server(
 
     db.commit()
     db.refresh(server)
+    server_registry.invalidate(server.id)
     return server
 
 
@@ -101,4 +102,5 @@ async def delete_server(
 
     db.delete(server)
     db.commit()
+    server_registry.invalidate(server_id)
     return None
@@ -16,13 +16,20 @@ celery_app.conf.update(
     enable_utc=True,
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
+    # Reserve one task at a time, so a slow alert shard never holds back queued ones
+    worker_prefetch_multiplier=1,
 )
 
+# Alert shards run on their own queue, so alert workers scale independently
+celery_app.conf.task_routes = {
+    "app.services.alert_service.evaluate_alert_shard": {"queue": settings.ALERT_QUEUE},
+}
+
 # Periodic tasks schedule
 celery_app.conf.beat_schedule = {
     "check-alert-rules": {
         "task": "app.services.alert_service.check_alert_rules",
-        "schedule": settings.ALERT_CHECK_INTERVAL_SECONDS,
+        "schedule": settings.ALERT_SCHEDULER_TICK_SECONDS,
     },
 }
 
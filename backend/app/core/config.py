@@ -22,10 +22,44 @@ class Settings(BaseSettings):
     # Celery
     CELERY_BROKER_URL: str = "redis://redis:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://redis:6379/0"
-    ALERT_CHECK_INTERVAL_SECONDS: int = 60
+    ALERT_CHECK_INTERVAL_SECONDS: int = 60  # Default evaluation interval of rules without eval_interval_sec
+    ALERT_SCHEDULER_TICK_SECONDS: int = 5  # How often due rules are dispatched
+    ALERT_SCHEDULE_BACKEND: str = "redis"  # "redis" (shared by workers) or "memory" (single dispatching process)
+    ALERT_SCHEDULE_JITTER: float = 0.1  # Fraction of a rule's interval its next run may shift by
+    ALERT_SCHEDULE_RESYNC_SECONDS: int = 300  # Resync the schedule with the rules table at least this often
+    ALERT_EVAL_CONCURRENCY: int = 50  # Queries (and notifications) in flight within a cycle
+    ALERT_EVENT_BATCH_SIZE: int = 500  # Alert events inserted per transaction
+    ALERT_STATE_BACKEND: str = "redis"  # "redis" (shared by workers, survives restarts) or "memory"
+    ALERT_STATE_TTL_SECONDS: int = 7 * 24 * 3600
+    ALERT_SHARDS: int = 4  # Shard tasks per cycle; set to at least the number of alert worker processes
+    ALERT_QUEUE: str = "alerts"  # Celery queue consumed by alert workers
+    WORKER_METRICS_PORT: int = 9808  # Prometheus metrics of Celery workers; 0 disables
 
     # Prometheus
     PROMETHEUS_URL: str = "http://prometheus:9090"
+    PROMETHEUS_TIMEOUT_SECONDS: float = 30.0
+    PROMETHEUS_MAX_CONNECTIONS: int = 100
+    PROMETHEUS_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    PROMETHEUS_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    PROMETHEUS_HTTP2: bool = False  # requires the optional "h2" package
+    PROMETHEUS_METRICS_DEADLINE_SECONDS: float = 10.0
+    PROMETHEUS_MAX_RESPONSE_BYTES: int = 128 * 1024 * 1024
+    PROMETHEUS_CONCURRENCY_INITIAL: int = 20
+    PROMETHEUS_CONCURRENCY_MIN: int = 2
+    PROMETHEUS_CONCURRENCY_MAX: int = 200
+    PROMETHEUS_LATENCY_TARGET_SECONDS: float = 1.0
+    PROMETHEUS_BREAKER_FAILURE_THRESHOLD: int = 5
+    PROMETHEUS_BREAKER_RESET_SECONDS: float = 30.0
+    PROMETHEUS_SCRAPE_INTERVAL_SECONDS: float = 15.0
+    PROMQL_CACHE_TTL_SECONDS: Optional[float] = None  # defaults to the scrape interval, 0 disables
+    PROMQL_CACHE_MAX_ENTRIES: int = 2048
+    PROMQL_RANGE_CACHE_BACKEND: str = "memory"  # memory, redis or none
+    PROMQL_RANGE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # memory backend only
+    PROMQL_RANGE_CACHE_BLOCK_SECONDS: int = 3600
+    PROMQL_RANGE_CACHE_FRESHNESS_SECONDS: int = 60  # newer blocks are never cached
+    PROMQL_RANGE_CACHE_REDIS_TTL_SECONDS: int = 7 * 24 * 3600
+    PROMQL_RANGE_SHARD_SECONDS: int = 24 * 3600  # 0 disables sharding of long range queries
+    PROMQL_RANGE_SHARD_CONCURRENCY: int = 4
 
     # Telegram
     TELEGRAM_BOT_TOKEN: Optional[str] = None
@@ -36,6 +70,13 @@ class Settings(BaseSettings):
 
     # WebSocket
     WS_METRICS_INTERVAL_SECONDS: int = 5
+    WS_BATCH_WINDOW_SECONDS: float = 0.5  # Wait after the first snapshot of a tick to batch the rest
+    WS_MAX_SUBSCRIPTIONS: int = 1000  # Servers per multiplexed socket
+    WS_DELTA_EPSILON: float = 0.01  # Smallest metric change sent to delta-protocol clients
+    WS_SLOW_CONSUMER_SECONDS: float = 30.0  # Disconnect clients whose sends stay blocked this long
+    WS_FANOUT_BACKEND: str = "local"  # "local" polls in every process, "redis" shares one poller per server
+    WS_BACKFILL_SECONDS: int = 15 * 60  # Recent samples kept per server for backfill
+    WS_SERVER_REGISTRY_TTL_SECONDS: float = 60.0  # How long streams trust cached server metadata
 
     class Config:
         env_file = ".env"
@@ -1,4 +1,5 @@
 import asyncio
+from typing import Any, Dict, Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
@@ -7,9 +8,11 @@ from starlette.responses import Response
 
 from .core import settings
 from .api import api_router
-from .db import Base, engine, get_db
-from .models import Server
-from .services import prometheus_service
+from .db import Base, engine
+from .services import prometheus_service, metrics_hub, recent_samples, server_registry
+from .services.delta_encoder import DELTA_SUBPROTOCOL, DeltaEncoder
+from .services.metrics_hub import SlowConsumer, Subscriber, ws_slow_consumer_disconnects
+from .services.series import pack
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -53,58 +56,178 @@ async def metrics():
     return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
-@app.websocket("/ws/metrics/{server_id}")
-async def websocket_metrics(websocket: WebSocket, server_id: int):
+async def _accept(websocket: WebSocket) -> Optional[DeltaEncoder]:
     """
-    WebSocket endpoint for real-time server metrics.
-    Streams metrics every N seconds.
+    Accept a metrics socket, returning a delta encoder if the client
+    requested the delta protocol.
     """
+    if DELTA_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        await websocket.accept(subprotocol=DELTA_SUBPROTOCOL)
+        return DeltaEncoder(epsilon=settings.WS_DELTA_EPSILON)
     await websocket.accept()
+    return None
 
-    # Get database session
-    db = next(get_db())
 
+async def _send(websocket: WebSocket, frame: Dict[str, Any], encoder: Optional[DeltaEncoder]) -> None:
+    """
+    Send a frame, giving up on clients that stay blocked past the slow-consumer threshold.
+    """
+    if encoder is None:
+        send = websocket.send_json(frame)
+    else:
+        send = websocket.send_bytes(pack(frame))
     try:
-        # Verify server exists
-        server = db.query(Server).filter(Server.id == server_id).first()
-        if not server:
-            await websocket.send_json({"error": "Server not found"})
-            await websocket.close()
-            return
-
-        if not server.is_active:
-            await websocket.send_json({"error": "Server is not active"})
-            await websocket.close()
-            return
-
-        # Stream metrics in a loop
+        await asyncio.wait_for(send, timeout=settings.WS_SLOW_CONSUMER_SECONDS)
+    except asyncio.TimeoutError:
+        ws_slow_consumer_disconnects.inc()
+        raise SlowConsumer(f"Send blocked for more than {settings.WS_SLOW_CONSUMER_SECONDS}s")
+
+
+@app.websocket("/ws/metrics/{server_id}")
+async def websocket_metrics(websocket: WebSocket, server_id: int):
+    """
+    WebSocket endpoint for real-time server metrics.
+    Streams metrics every N seconds from a poller shared by all viewers of the server.
+    """
+    encoder = await _accept(websocket)
+
+    # Server metadata comes from the registry, so no DB session is held while streaming
+    server = await server_registry.get(server_id)
+    if not server:
+        await _send(websocket, {"error": "Server not found"}, encoder)
+        await websocket.close()
+        return
+
+    if not server.is_active:
+        await _send(websocket, {"error": "Server is not active"}, encoder)
+        await websocket.close()
+        return
+
+    # Stream snapshots from the server's shared poller
+    subscriber = Subscriber()
+    metrics_hub.subscribe(server, subscriber)
+    try:
+        # Recent samples first, so charts don't wait for the next poll
+        backfill = recent_samples.get(server.id, binary=encoder is not None)
+        await _send(websocket, {"type": "backfill", **backfill}, encoder)
         while True:
-            try:
-                # Fetch metrics from Prometheus
-                metrics = await prometheus_service.get_server_metrics(
-                    job_name=server.job_name,
-                    instance=server.instance
-                )
-
-                # Send metrics to client
-                await websocket.send_json({
-                    "server_id": server.id,
-                    "server_name": server.name,
-                    "timestamp": __import__('datetime').datetime.utcnow().isoformat(),
-                    "metrics": metrics
-                })
-
-                # Wait before next update
-                await asyncio.sleep(settings.WS_METRICS_INTERVAL_SECONDS)
-
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                await websocket.send_json({"error": str(e)})
-                break
+            await subscriber.wait()
+            for snapshot in subscriber.drain():
+                if encoder is not None:
+                    snapshot = encoder.encode(snapshot)
+                await _send(websocket, snapshot, encoder)
+    except WebSocketDisconnect:
+        pass
+    except SlowConsumer as e:
+        print(f"Disconnecting slow metrics client for server {server_id}: {e}")
+    finally:
+        metrics_hub.unsubscribe(server.id, subscriber)
+
+
+async def _receive_subscriptions(
+    websocket: WebSocket,
+    subscriber: Subscriber,
+    encoder: Optional[DeltaEncoder],
+) -> None:
+    while True:
+        message = await websocket.receive_json()
+        action = message.get("action") if isinstance(message, dict) else None
+        server_ids = message.get("server_ids") if isinstance(message, dict) else None
+        if action not in ("subscribe", "unsubscribe") or not isinstance(server_ids, list) \
+                or not all(isinstance(server_id, int) for server_id in server_ids):
+            await _send(websocket, {
+                "type": "error",
+                "error": "Expected {\"action\": \"subscribe\" | \"unsubscribe\", \"server_ids\": [int, ...]}",
+            }, encoder)
+            continue
+
+        requested = set(server_ids)
+        if action == "unsubscribe":
+            for server_id in requested:
+                metrics_hub.unsubscribe(server_id, subscriber)
+                if encoder is not None:
+                    encoder.forget(server_id)
+            await _send(websocket, {"type": "unsubscribed", "server_ids": sorted(requested)}, encoder)
+            continue
+
+        new_ids = requested - subscriber.server_ids
+        if len(subscriber.server_ids) + len(new_ids) > settings.WS_MAX_SUBSCRIPTIONS:
+            await _send(websocket, {
+                "type": "error",
+                "error": f"At most {settings.WS_MAX_SUBSCRIPTIONS} servers per connection",
+                "server_ids": sorted(new_ids),
+            }, encoder)
+            continue
+
+        servers = await server_registry.get_many(new_ids) if new_ids else {}
+        subscribed = []
+        for server in servers.values():
+            if server.is_active:
+                metrics_hub.subscribe(server, subscriber)
+                subscribed.append(server.id)
+        rejected = new_ids - set(subscribed)
+        if rejected:
+            await _send(websocket, {
+                "type": "error",
+                "error": "Server not found or not active",
+                "server_ids": sorted(rejected),
+            }, encoder)
+        await _send(websocket, {
+            "type": "subscribed",
+            "server_ids": sorted(requested - rejected),
+        }, encoder)
+        if subscribed:
+            await _send(websocket, {
+                "type": "backfill",
+                "servers": [
+                    recent_samples.get(server_id, binary=encoder is not None)
+                    for server_id in sorted(subscribed)
+                ],
+            }, encoder)
+
+
+async def _send_batches(
+    websocket: WebSocket,
+    subscriber: Subscriber,
+    encoder: Optional[DeltaEncoder],
+) -> None:
+    while True:
+        batch = await metrics_hub.next_batch(subscriber, settings.WS_BATCH_WINDOW_SECONDS)
+        if encoder is not None:
+            batch = encoder.encode_batch(batch)
+        await _send(websocket, {"type": "metrics", "servers": batch}, encoder)
+
+
+@app.websocket("/ws/metrics")
+async def websocket_metrics_multiplexed(websocket: WebSocket):
+    """
+    WebSocket endpoint for real-time metrics of many servers over one connection.
+    The client sends {"action": "subscribe" | "unsubscribe", "server_ids": [...]}
+    and receives at most one {"type": "metrics", "servers": [...]} frame per interval.
+    Clients offering the delta subprotocol get msgpack frames with changed fields only.
+    """
+    encoder = await _accept(websocket)
 
+    subscriber = Subscriber()
+    tasks = [
+        asyncio.ensure_future(_receive_subscriptions(websocket, subscriber, encoder)),
+        asyncio.ensure_future(_send_batches(websocket, subscriber, encoder)),
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, SlowConsumer):
+                print(f"Disconnecting slow metrics client: {error}")
+            elif error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"WebSocket metrics stream failed: {error}")
     finally:
-        db.close()
+        for task in tasks:
+            task.cancel()
+        metrics_hub.unsubscribe_all(subscriber)
 
 
 @app.on_event("startup")
@@ -114,6 +237,7 @@ async def startup_event():
     """
     print(f"Starting {settings.PROJECT_NAME} v{settings.VERSION}")
     print(f"Documentation available at /docs")
+    await prometheus_service.start()
 
 
 @app.on_event("shutdown")
@@ -122,3 +246,5 @@ async def shutdown_event():
     Run on application shutdown.
     """
     print(f"Shutting down {settings.PROJECT_NAME}")
+    await metrics_hub.close()
+    await prometheus_service.close()
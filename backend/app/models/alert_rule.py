@@ -8,14 +8,17 @@ class AlertRule(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False, index=True)
-    server_id = Column(Integer, ForeignKey("servers.id", ondelete="CASCADE"), nullable=False)
+    server_id = Column(Integer, ForeignKey("servers.id", ondelete="CASCADE"), nullable=True)  # required in single mode
     metric_name = Column(String, nullable=False)
     promql = Column(String, nullable=False)
     threshold = Column(Float, nullable=False)
     comparison = Column(String, nullable=False)  # >, <, >=, <=, ==, !=
     repeat_interval_sec = Column(Integer, default=300)  # 5 minutes
+    for_duration_sec = Column(Integer, default=0)  # how long the condition must hold before firing
+    eval_interval_sec = Column(Integer, nullable=True)  # None: ALERT_CHECK_INTERVAL_SECONDS
     is_active = Column(Boolean, default=True)
     channel = Column(String, default="telegram")  # notification channel
+    evaluation_mode = Column(String, default="single")  # single: one server, vector: every matching server
 
     # Relationships
     server = relationship("Server", back_populates="alert_rules")
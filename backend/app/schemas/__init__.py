@@ -2,7 +2,7 @@ from .user import UserCreate, UserResponse, Token, TokenPayload
 from .server import ServerCreate, ServerUpdate, ServerResponse
 from .alert_rule import AlertRuleCreate, AlertRuleUpdate, AlertRuleResponse
 from .alert_event import AlertEventCreate, AlertEventResponse
-from .metrics import MetricSummary, HealthResponse
+from .metrics import MetricSummary, MetricSeries, MetricHistory, RecentMetrics, HealthResponse
 
 __all__ = [
     "UserCreate",
@@ -18,5 +18,8 @@ __all__ = [
     "AlertEventCreate",
     "AlertEventResponse",
     "MetricSummary",
+    "MetricSeries",
+    "MetricHistory",
+    "RecentMetrics",
     "HealthResponse",
 ]
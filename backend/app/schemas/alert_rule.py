@@ -4,14 +4,17 @@ from typing import Optional
 
 class AlertRuleBase(BaseModel):
     name: str
-    server_id: int
+    server_id: Optional[int] = None  # required for single-server rules
     metric_name: str
     promql: str
     threshold: float
     comparison: str  # >, <, >=, <=, ==, !=
     repeat_interval_sec: int = 300
+    for_duration_sec: int = 0
+    eval_interval_sec: Optional[int] = None  # defaults to the global check interval
     is_active: bool = True
     channel: str = "telegram"
+    evaluation_mode: str = "single"  # single, vector
 
 
 class AlertRuleCreate(AlertRuleBase):
@@ -25,8 +28,11 @@ class AlertRuleUpdate(BaseModel):
     threshold: Optional[float] = None
     comparison: Optional[str] = None
     repeat_interval_sec: Optional[int] = None
+    for_duration_sec: Optional[int] = None
+    eval_interval_sec: Optional[int] = None
     is_active: Optional[bool] = None
     channel: Optional[str] = None
+    evaluation_mode: Optional[str] = None
 
 
 class AlertRuleResponse(AlertRuleBase):
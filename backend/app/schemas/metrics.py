@@ -1,11 +1,34 @@
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 
 class MetricSummary(BaseModel):
     server_id: int
     server_name: str
     metrics: Dict[str, Any]
+    errors: Dict[str, str] = {}  # metric name -> "timeout" or "error"
+
+
+class MetricSeries(BaseModel):
+    labels: Dict[str, str]
+    values: List[Tuple[float, Optional[float]]]  # [unix timestamp, value]
+
+
+class MetricHistory(BaseModel):
+    server_id: int
+    server_name: str
+    metric: str
+    start: float
+    end: float
+    step: int  # seconds
+    series: List[MetricSeries]
+
+
+class RecentMetrics(BaseModel):
+    server_id: int
+    server_name: str
+    timestamps: List[float]  # unix timestamps, oldest first
+    metrics: Dict[str, List[Optional[float]]]  # metric name -> value per timestamp
 
 
 class HealthResponse(BaseModel):
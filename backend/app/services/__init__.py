@@ -1,7 +1,10 @@
 from .auth_service import authenticate_user, get_current_user, get_current_superuser
 from .prometheus_service import prometheus_service
 from .telegram_service import telegram_service
-from .alert_service import check_alert_rules
+from .alert_service import check_alert_rules, mark_alert_rules_changed
+from .metrics_hub import metrics_hub
+from .recent_samples import recent_samples
+from .server_registry import server_registry
 
 __all__ = [
     "authenticate_user",
@@ -10,4 +13,8 @@ __all__ = [
     "prometheus_service",
     "telegram_service",
     "check_alert_rules",
+    "mark_alert_rules_changed",
+    "metrics_hub",
+    "recent_samples",
+    "server_registry",
 ]
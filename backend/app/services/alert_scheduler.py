@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import random
+from typing import Dict, List, Optional, Tuple
+import redis.asyncio as redis
+
+SCHEDULE_KEY = "vigil:alert-schedule"
+INTERVALS_KEY = "vigil:alert-schedule:intervals"
+CHANGES_KEY = "vigil:alert-schedule:changes"
+
+# rule ID -> evaluation interval in seconds, for every active rule
+RuleIntervals = Dict[int, float]
+
+
+def next_due(due: float, now: float, interval: float, jitter: float) -> float:
+    """
+    Time of a rule's next evaluation: one interval after its previous due
+    time rather than after the tick that ran it, so tick lag does not add
+    up, and no earlier than now for a rule that fell behind. Spread by +/-
+    jitter (a fraction of the interval) so rules with the same interval do
+    not all land on one tick.
+    """
+    return max(due + interval, now) + interval * random.uniform(-jitter, jitter)
+
+
+class MemoryAlertSchedule:
+    """
+    Due times of alert rules in a min-heap kept in the current process;
+    only correct when a single process dispatches alert checks, and rule
+    changes made in other processes are only seen on the periodic resync.
+
+    Superseded heap entries (rescheduled or removed rules) are skipped when
+    they reach the top instead of being searched for.
+    """
+
+    def __init__(self, jitter: float):
+        self.jitter = jitter
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._intervals: RuleIntervals = {}
+        self._changes = 0
+
+    async def changes(self) -> int:
+        """
+        Counter bumped whenever alert rules are created, updated or deleted.
+        """
+        return self._changes
+
+    async def mark_changed(self) -> None:
+        self._changes += 1
+
+    async def sync(self, intervals: RuleIntervals, now: float) -> None:
+        """
+        Follow the active rules: schedule new ones, drop removed ones and
+        apply changed intervals.
+        """
+        for rule_id in list(self._due):
+            if rule_id not in intervals:
+                del self._due[rule_id]
+        for rule_id, interval in intervals.items():
+            due = self._due.get(rule_id)
+            # New rules run right away; a shortened interval applies immediately
+            if due is None or due > now + interval:
+                self._push(rule_id, now if due is None else now + interval)
+        self._intervals = dict(intervals)
+
+    async def pop_due(self, now: float) -> List[int]:
+        """
+        Return the rules due at `now` and schedule their next evaluation.
+        """
+        popped = []
+        while self._heap and self._heap[0][0] <= now:
+            due, rule_id = heapq.heappop(self._heap)
+            if self._due.get(rule_id) == due:
+                popped.append((rule_id, due))
+        # Rescheduled after popping, as the next due time may be now again
+        for rule_id, due in popped:
+            self._push(rule_id, next_due(due, now, self._intervals[rule_id], self.jitter))
+        return [rule_id for rule_id, _ in popped]
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._due.clear()
+        self._intervals.clear()
+        self._changes = 0
+
+    def _push(self, rule_id: int, due: float) -> None:
+        self._due[rule_id] = due
+        heapq.heappush(self._heap, (due, rule_id))
+
+
+class RedisAlertSchedule:
+    """
+    Due times of alert rules in a Redis sorted set (rule ID scored by due
+    time) with their intervals in a hash, shared by every process that
+    dispatches alert checks.
+
+    Due rules are claimed under WATCH/MULTI, so overlapping ticks never
+    dispatch the same rule twice; only the due members are read.
+    """
+
+    def __init__(self, url: str, jitter: float):
+        self.url = url
+        self.jitter = jitter
+        self._client: Optional[redis.Redis] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> redis.Redis:
+        # Connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = redis.from_url(self.url)
+            self._client_loop = loop
+        return self._client
+
+    async def changes(self) -> int:
+        """
+        Counter bumped whenever alert rules are created, updated or deleted.
+        """
+        return int(await self._get_client().get(CHANGES_KEY) or 0)
+
+    async def mark_changed(self) -> None:
+        await self._get_client().incr(CHANGES_KEY)
+
+    async def sync(self, intervals: RuleIntervals, now: float) -> None:
+        """
+        Follow the active rules: schedule new ones, drop removed ones and
+        apply changed intervals.
+        """
+        client = self._get_client()
+        scheduled = {int(rule_id): due for rule_id, due in await client.zrange(SCHEDULE_KEY, 0, -1, withscores=True)}
+        removed = [rule_id for rule_id in scheduled if rule_id not in intervals]
+        added = {rule_id: now for rule_id in intervals if rule_id not in scheduled}
+        shortened = {
+            rule_id: now + interval
+            for rule_id, interval in intervals.items()
+            if scheduled.get(rule_id, now) > now + interval
+        }
+
+        # One transaction, so a concurrent pop_due retries instead of
+        # seeing the intervals and the set half updated
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(INTERVALS_KEY)
+        if intervals:
+            pipe.hset(INTERVALS_KEY, mapping=intervals)
+        if removed:
+            pipe.zrem(SCHEDULE_KEY, *removed)
+        if added:
+            pipe.zadd(SCHEDULE_KEY, added, nx=True)
+        if shortened:
+            # LT never pushes back a due time a concurrent pop just set
+            pipe.zadd(SCHEDULE_KEY, shortened, lt=True)
+        await pipe.execute()
+
+    async def pop_due(self, now: float) -> List[int]:
+        """
+        Return the rules due at `now` and schedule their next evaluation.
+        """
+        async with self._get_client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Another tick changing the set first makes EXEC fail
+                    await pipe.watch(SCHEDULE_KEY)
+                    scheduled = await pipe.zrangebyscore(SCHEDULE_KEY, "-inf", now, withscores=True)
+                    if not scheduled:
+                        return []
+                    due_ids = [rule_id for rule_id, _ in scheduled]
+                    intervals = await pipe.hmget(INTERVALS_KEY, due_ids)
+
+                    pipe.multi()
+                    updates = {
+                        rule_id: next_due(due, now, float(interval), self.jitter)
+                        for (rule_id, due), interval in zip(scheduled, intervals)
+                        if interval is not None
+                    }
+                    # Members without an interval are left over from a lost hash; the next sync re-adds live ones
+                    orphans = [rule_id for rule_id in due_ids if rule_id not in updates]
+                    if updates:
+                        pipe.zadd(SCHEDULE_KEY, updates)
+                    if orphans:
+                        pipe.zrem(SCHEDULE_KEY, *orphans)
+                    await pipe.execute()
+                    return [int(rule_id) for rule_id in due_ids if rule_id in updates]
+                except redis.WatchError:
+                    continue
@@ -1,12 +1,178 @@
 import asyncio
-from datetime import datetime, timedelta
+import hashlib
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from ..core import settings
 from ..core.celery_app import celery_app
 from ..db.session import SessionLocal
 from ..models import AlertRule, AlertEvent, Server
-from .prometheus_service import prometheus_service
+from .alert_scheduler import MemoryAlertSchedule, RedisAlertSchedule
+from .alert_state import (
+    STATE_FIRING,
+    STATE_PENDING,
+    MemoryAlertStateStore,
+    RedisAlertStateStore,
+    StateUpdates,
+)
+from .prometheus_service import normalize_promql, prometheus_service
 from .telegram_service import telegram_service
 
+alert_cycle_duration = Histogram(
+    "vigil_alert_cycle_duration_seconds",
+    "Time taken to evaluate an alert shard's rules once.",
+    ["shard"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+alert_cycle_throughput = Gauge(
+    "vigil_alert_cycle_rules_per_second",
+    "Alert rules evaluated per second in the shard's last cycle.",
+    ["shard"],
+    multiprocess_mode="livemostrecent",
+)
+alert_cycle_rules = Gauge(
+    "vigil_alert_cycle_rules",
+    "Active alert rules evaluated in the shard's last cycle.",
+    ["shard"],
+    multiprocess_mode="livemostrecent",
+)
+alert_cycle_queries = Gauge(
+    "vigil_alert_cycle_queries",
+    "Distinct PromQL queries run in the shard's last cycle.",
+    ["shard"],
+    multiprocess_mode="livemostrecent",
+)
+alert_rule_evaluations = Counter(
+    "vigil_alert_rule_evaluations_total",
+    "Alert rule evaluations by outcome.",
+    ["result"],
+)
+
+def _create_state_store():
+    """
+    Build the alert state store for the configured backend.
+    """
+    if settings.ALERT_STATE_BACKEND == "redis":
+        return RedisAlertStateStore(settings.REDIS_URL, ttl=settings.ALERT_STATE_TTL_SECONDS)
+    return MemoryAlertStateStore()
+
+
+alert_state_store = _create_state_store()
+
+
+def _create_schedule():
+    """
+    Build the alert schedule for the configured backend.
+    """
+    if settings.ALERT_SCHEDULE_BACKEND == "redis":
+        return RedisAlertSchedule(settings.REDIS_URL, jitter=settings.ALERT_SCHEDULE_JITTER)
+    return MemoryAlertSchedule(jitter=settings.ALERT_SCHEDULE_JITTER)
+
+
+alert_schedule = _create_schedule()
+
+# Rule change counter and time of this process' last schedule sync
+_schedule_synced: Tuple[Optional[int], float] = (None, 0.0)
+
+# Event loop owned by the current worker process, so the pooled Prometheus
+# client keeps its connections alive between tasks.
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+@worker_init.connect
+def start_worker_metrics_server(**kwargs):
+    """
+    Serve the alert cycle collectors of this worker on WORKER_METRICS_PORT.
+
+    With PROMETHEUS_MULTIPROC_DIR set, the prefork pool processes write
+    their samples there and this server, started in the parent, aggregates them.
+    """
+    if not settings.WORKER_METRICS_PORT:
+        return
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    try:
+        start_http_server(settings.WORKER_METRICS_PORT, registry=registry)
+    except OSError as e:
+        print(f"Error starting worker metrics server on port {settings.WORKER_METRICS_PORT}: {e}")
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Create the worker's event loop and open the shared Prometheus client.
+    """
+    global _worker_loop
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    _worker_loop.run_until_complete(prometheus_service.start())
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """
+    Close the shared Prometheus client and the worker's event loop, and
+    retire the process' live gauges in multiprocess mode.
+    """
+    global _worker_loop
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+    if _worker_loop is None:
+        return
+    _worker_loop.run_until_complete(prometheus_service.close())
+    _worker_loop.close()
+    _worker_loop = None
+
+
+def run_async(coro):
+    """
+    Run a coroutine on the worker's event loop, or a fresh one outside a worker process.
+    """
+    if _worker_loop is None:
+        return asyncio.run(coro)
+    return _worker_loop.run_until_complete(coro)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash: map key to one of `buckets` shards, moving only
+    about 1/buckets of the keys when a shard is added.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def query_shard(promql: str, shards: int) -> int:
+    """
+    Shard of a rule, by consistent hash of its normalized PromQL, so rules
+    sharing a query are evaluated together and the query still runs once.
+    """
+    digest = hashlib.sha1(normalize_promql(promql).encode()).digest()
+    return jump_hash(int.from_bytes(digest[:8], "big"), shards)
+
+
+def shard_rules(rules: Dict[int, str], shards: int) -> Dict[int, List[int]]:
+    """
+    Split rule IDs (mapped to their PromQL) into shards; empty shards are left out.
+    """
+    sharded: Dict[int, List[int]] = defaultdict(list)
+    for rule_id, promql in rules.items():
+        sharded[query_shard(promql, shards)].append(rule_id)
+    return dict(sharded)
+
 
 def compare_values(value: float, threshold: float, comparison: str) -> bool:
     """
@@ -27,82 +193,426 @@ def compare_values(value: float, threshold: float, comparison: str) -> bool:
     return False
 
 
-async def process_alert_rule(db: Session, rule: AlertRule):
+class ServerIndex:
     """
-    Process a single alert rule: query Prometheus and trigger alert if needed.
+    Active servers by ID, by Prometheus target (job, instance) and by
+    instance alone, used to attribute the series of a query result to servers.
     """
-    # Get server info
-    server = db.query(Server).filter(Server.id == rule.server_id).first()
-    if not server or not server.is_active:
-        return
 
-    # Execute PromQL query
-    result = await prometheus_service.query(rule.promql)
-    if not result or not result.get("result"):
-        return
+    def __init__(self, servers: List[Server]):
+        self.by_id = {server.id: server for server in servers if server.is_active}
+        self.by_target = {(server.job_name, server.instance): server for server in self.by_id.values()}
+        self.instances = {server.instance for server in self.by_id.values()}
+
+    @classmethod
+    def load(cls, db: Session) -> "ServerIndex":
+        return cls(db.query(Server).filter(Server.is_active == True).all())
+
+    def match(self, labels: Dict[str, str]) -> Optional[Server]:
+        return self.by_target.get((labels.get("job"), labels.get("instance")))
 
-    # Extract metric value
+
+def series_value(series: Dict[str, Any]) -> Optional[float]:
     try:
-        value = float(result["result"][0]["value"][1])
-    except (IndexError, ValueError, KeyError):
-        return
+        return float(series["value"][1])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+class SeriesValues(NamedTuple):
+    """
+    A query result reduced to what alert rules need: the value of each
+    known server's series by (job, instance) and by instance alone, and the
+    first value of a series that belongs to no known server.
+    """
+
+    by_server: Dict[int, float]
+    by_instance: Dict[str, float]
+    first: Optional[float]
+
+
+async def query_series_values(query: str, servers: ServerIndex) -> Optional[SeriesValues]:
+    """
+    Run a PromQL query and reduce its series to values one at a time as they
+    are parsed, so a fleet-wide result is never held in full.
+
+    Returns None when the query fails.
+    """
+    by_server: Dict[int, float] = {}
+    by_instance: Dict[str, float] = {}
+    first = None
+    stream = prometheus_service.iter_query(query)
+    try:
+        async for series in stream:
+            value = series_value(series)
+            if value is None:
+                continue
+            labels = series.get("metric", {})
+            server = servers.match(labels)
+            if server is not None:
+                by_server.setdefault(server.id, value)
+            instance = labels.get("instance")
+            if instance in servers.instances:
+                by_instance.setdefault(instance, value)
+            elif server is None and first is None:
+                first = value
+    except Exception as e:
+        print(f"Error querying Prometheus: {e}")
+        return None
+    finally:
+        await stream.aclose()
+    return SeriesValues(by_server, by_instance, first)
+
+
+def match_series(
+    rule: AlertRule,
+    values: SeriesValues,
+    servers: ServerIndex,
+) -> List[Tuple[Server, float]]:
+    """
+    Attribute the values of a rule's result to servers.
+
+    Vector rules use the value of every server whose job/instance labels
+    appear in the result; series of unknown or inactive servers are skipped.
+    Single-server rules use the series of their own server, matched by
+    job/instance or else by instance alone (e.g. `avg by (instance)`), or
+    else the first series that belongs to no known server (an aggregate, or
+    another exporter's target); other servers' series never apply to them.
+    """
+    if rule.evaluation_mode == "vector":
+        return [(servers.by_id[server_id], value) for server_id, value in values.by_server.items()]
+
+    server = servers.by_id.get(rule.server_id)
+    if server is None:
+        return []
+    if server.id in values.by_server:
+        value = values.by_server[server.id]
+    elif server.instance in values.by_instance:
+        value = values.by_instance[server.instance]
+    else:
+        value = values.first
+    return [(server, value)] if value is not None else []
 
-    # Check if alert should be triggered
-    should_alert = compare_values(value, rule.threshold, rule.comparison)
-
-    # Check for recent alerts to respect repeat_interval
-    recent_cutoff = datetime.utcnow() - timedelta(seconds=rule.repeat_interval_sec)
-    recent_alert = (
-        db.query(AlertEvent)
-        .filter(
-            AlertEvent.alert_rule_id == rule.id,
-            AlertEvent.status == "triggered",
-            AlertEvent.created_at >= recent_cutoff,
-        )
-        .first()
-    )
-
-    if should_alert and not recent_alert:
-        # Create alert event
-        alert_event = AlertEvent(
-            alert_rule_id=rule.id,
-            server_id=server.id,
-            metric_name=rule.metric_name,
-            value=value,
-            status="triggered",
-        )
-        db.add(alert_event)
-        db.commit()
 
-        # Send notification
-        if rule.channel == "telegram":
+class AlertTransition(NamedTuple):
+    rule: AlertRule
+    server: Server
+    value: float
+    status: str  # triggered, resolved
+    created_at: datetime
+    reminder: bool = False  # repeat notification of a still-firing alert, not stored
+
+
+def apply_alert_rule(
+    rule: AlertRule,
+    values: Optional[SeriesValues],
+    servers: ServerIndex,
+    states: Dict[int, Dict[str, Any]],
+    now: float,
+) -> Tuple[List[AlertTransition], Dict[int, Optional[Dict[str, Any]]]]:
+    """
+    Advance the rule's alert state for every server from the result of its query.
+
+    A server crossing the threshold becomes pending, and firing once it has
+    been pending for the rule's for_duration_sec (immediately without one);
+    a firing alert whose condition clears or whose series disappears is
+    resolved. Returns the transitions to store and notify, plus the state
+    changes by server ID (None deletes the state).
+    """
+    if values is None:
+        # The query failed: keep every state as it is
+        return [], {}
+
+    transitions: List[AlertTransition] = []
+    updates: Dict[int, Optional[Dict[str, Any]]] = {}
+    created_at = datetime.utcfromtimestamp(now)
+    for_duration = rule.for_duration_sec or 0
+    seen = set()
+
+    for server, value in match_series(rule, values, servers):
+        seen.add(server.id)
+        state = states.get(server.id)
+
+        # Check if alert condition holds
+        if compare_values(value, rule.threshold, rule.comparison):
+            if state is None or state["state"] == STATE_PENDING:
+                since = state["since"] if state else now
+                if now - since >= for_duration:
+                    updates[server.id] = {"state": STATE_FIRING, "since": since, "value": value, "notified_at": now}
+                    transitions.append(AlertTransition(rule, server, value, "triggered", created_at))
+                elif state is None:
+                    updates[server.id] = {"state": STATE_PENDING, "since": now, "value": value}
+            elif now - state["notified_at"] >= rule.repeat_interval_sec:
+                # Still firing: remind every repeat_interval
+                updates[server.id] = dict(state, value=value, notified_at=now)
+                transitions.append(AlertTransition(rule, server, value, "triggered", created_at, reminder=True))
+        elif state is not None:
+            updates[server.id] = None
+            if state["state"] == STATE_FIRING:
+                transitions.append(AlertTransition(rule, server, value, "resolved", created_at))
+
+    # Series that are gone resolve their alerts too
+    for server_id, state in states.items():
+        if server_id in seen:
+            continue
+        updates[server_id] = None
+        server = servers.by_id.get(server_id)
+        if state["state"] == STATE_FIRING and server is not None:
+            transitions.append(AlertTransition(rule, server, state["value"], "resolved", created_at))
+
+    return transitions, updates
+
+
+def save_alert_events(db: Session, transitions: List[AlertTransition]) -> List[AlertTransition]:
+    """
+    Insert the events of state transitions in bulk, one transaction per chunk
+    of ALERT_EVENT_BATCH_SIZE, and return the transitions that were stored.
+    """
+    saved = []
+    batch_size = settings.ALERT_EVENT_BATCH_SIZE
+    for offset in range(0, len(transitions), batch_size):
+        chunk = transitions[offset:offset + batch_size]
+        try:
+            db.execute(insert(AlertEvent), [
+                {
+                    "alert_rule_id": transition.rule.id,
+                    "server_id": transition.server.id,
+                    "metric_name": transition.rule.metric_name,
+                    "value": transition.value,
+                    "status": transition.status,
+                    "created_at": transition.created_at,
+                }
+                for transition in chunk
+            ])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error saving {len(chunk)} alert events: {e}")
+            continue
+        saved.extend(chunk)
+    return saved
+
+
+async def commit_transitions(
+    db: Session,
+    transitions: List[AlertTransition],
+    updates: StateUpdates,
+) -> List[AlertTransition]:
+    """
+    Store the events of state transitions, then the new states, then notify.
+
+    A transition whose event could not be stored keeps its previous state,
+    so the next cycle produces it again. Returns the stored transitions.
+    """
+    stored = [transition for transition in transitions if not transition.reminder]
+    saved = save_alert_events(db, stored)
+    if len(saved) < len(stored):
+        saved_keys = {(transition.rule.id, transition.server.id) for transition in saved}
+        for transition in stored:
+            key = (transition.rule.id, transition.server.id)
+            if key not in saved_keys:
+                updates.get(transition.rule.id, {}).pop(transition.server.id, None)
+
+    await alert_state_store.save({rule_id: changes for rule_id, changes in updates.items() if changes})
+    await notify_alerts(saved + [transition for transition in transitions if transition.reminder])
+    return saved
+
+
+async def notify_alerts(transitions: List[AlertTransition]) -> None:
+    """
+    Send notifications for transitions, at most ALERT_EVAL_CONCURRENCY at a time.
+    """
+    semaphore = asyncio.Semaphore(settings.ALERT_EVAL_CONCURRENCY)
+
+    async def notify(transition: AlertTransition) -> None:
+        rule = transition.rule
+        if rule.channel != "telegram":
+            return
+        async with semaphore:
             await telegram_service.send_alert(
-                server_name=server.name,
+                server_name=transition.server.name,
                 alert_name=rule.name,
                 metric_name=rule.metric_name,
-                value=value,
+                value=transition.value,
                 threshold=rule.threshold,
                 comparison=rule.comparison,
-                status="triggered",
+                status=transition.status,
             )
 
+    results = await asyncio.gather(*(notify(transition) for transition in transitions), return_exceptions=True)
+    for transition, result in zip(transitions, results):
+        if isinstance(result, Exception):
+            print(f"Error sending notification for alert rule {transition.rule.id}: {result}")
+
+
+async def evaluate_alert_rules(db: Session, rules: List[AlertRule], shard: int = 0) -> Dict[str, Any]:
+    """
+    Evaluate rules and return the cycle's statistics.
+
+    Rules are grouped by normalized PromQL, so each distinct query runs once
+    per cycle and every rule in the group is checked against that result.
+    Queries run concurrently, at most ALERT_EVAL_CONCURRENCY at a time.
+
+    Alert state lives in the state store and is read and written once per
+    cycle; the database is only read for servers and written for state
+    transitions, whose events are inserted in bulk before notifications go out.
+    """
+    groups: Dict[str, List[AlertRule]] = defaultdict(list)
+    for rule in rules:
+        groups[normalize_promql(rule.promql)].append(rule)
+
+    servers = ServerIndex.load(db)
+    states = await alert_state_store.load(rule.id for rule in rules)
+    now = time.time()
+    semaphore = asyncio.Semaphore(settings.ALERT_EVAL_CONCURRENCY)
+    transitions: List[AlertTransition] = []
+    updates: StateUpdates = {}
+    failed = 0
+
+    async def evaluate(group: List[AlertRule]) -> None:
+        nonlocal failed
+        # The normalized form is only a grouping key; PromQL comments run to
+        # the end of the line, so the expression is sent as written
+        async with semaphore:
+            values = await query_series_values(group[0].promql, servers)
+        for rule in group:
+            try:
+                rule_transitions, updates[rule.id] = apply_alert_rule(
+                    rule, values, servers, states.get(rule.id, {}), now
+                )
+                transitions.extend(rule_transitions)
+                alert_rule_evaluations.labels(result="ok").inc()
+            except Exception as e:
+                failed += 1
+                alert_rule_evaluations.labels(result="error").inc()
+                print(f"Error processing alert rule {rule.id}: {e}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(evaluate(group) for group in groups.values()))
+    saved = await commit_transitions(db, transitions, updates)
+    duration = time.monotonic() - started
+
+    throughput = len(rules) / duration if duration > 0 else 0.0
+    label = str(shard)
+    alert_cycle_duration.labels(shard=label).observe(duration)
+    alert_cycle_throughput.labels(shard=label).set(throughput)
+    alert_cycle_rules.labels(shard=label).set(len(rules))
+    alert_cycle_queries.labels(shard=label).set(len(groups))
+    return {
+        "shard": shard,
+        "rules": len(rules),
+        "queries": len(groups),
+        "events": len(saved),
+        "failed": failed,
+        "duration_seconds": duration,
+        "rules_per_second": throughput,
+    }
+
+
+async def mark_alert_rules_changed() -> None:
+    """
+    Have the next scheduler tick resync the schedule with the rules table.
+    """
+    try:
+        await alert_schedule.mark_changed()
+    except Exception as e:
+        # The periodic resync still picks the change up
+        print(f"Error marking alert rules changed: {e}")
+
+
+def sync_alert_schedule(now: float) -> int:
+    """
+    Load the active rules' intervals and sync the schedule with them.
+    """
+    db = SessionLocal()
+    try:
+        active = db.query(AlertRule.id, AlertRule.eval_interval_sec).filter(AlertRule.is_active == True).all()
+    finally:
+        db.close()
+
+    intervals = {
+        rule_id: interval or settings.ALERT_CHECK_INTERVAL_SECONDS
+        for rule_id, interval in active
+    }
+    run_async(alert_schedule.sync(intervals, now))
+    return len(intervals)
+
 
 @celery_app.task(name="app.services.alert_service.check_alert_rules")
 def check_alert_rules():
     """
-    Celery task to check all active alert rules.
+    Celery task run every scheduler tick: pick the alert rules that are
+    due, split them into shards and dispatch one evaluation task per shard
+    to the alerts queue.
+
+    The rules table is only read in full when rules changed (or every
+    ALERT_SCHEDULE_RESYNC_SECONDS); other ticks load just the due rules.
     """
+    global _schedule_synced
+    now = time.time()
+
+    changes = run_async(alert_schedule.changes())
+    synced_changes, synced_at = _schedule_synced
+    synced = changes != synced_changes or now - synced_at >= settings.ALERT_SCHEDULE_RESYNC_SECONDS
+    if synced:
+        active = sync_alert_schedule(now)
+        _schedule_synced = (changes, now)
+        print(f"Synced alert schedule with {active} active rules")
+
+    due_ids = run_async(alert_schedule.pop_due(now))
+    if not due_ids:
+        return {"synced": synced, "due": 0, "shards": 0}
+
     db = SessionLocal()
     try:
-        # Get all active alert rules
-        rules = db.query(AlertRule).filter(AlertRule.is_active == True).all()
+        # Rules may have been disabled or deleted since the last sync
+        due = db.query(
+            AlertRule.id, AlertRule.promql, AlertRule.eval_interval_sec
+        ).filter(AlertRule.id.in_(due_ids), AlertRule.is_active == True).all()
+    finally:
+        db.close()
 
-        # Process each rule
-        for rule in rules:
-            try:
-                asyncio.run(process_alert_rule(db, rule))
-            except Exception as e:
-                print(f"Error processing alert rule {rule.id}: {e}")
+    queries = {rule_id: promql for rule_id, promql, _ in due}
+    intervals = {
+        rule_id: interval or settings.ALERT_CHECK_INTERVAL_SECONDS
+        for rule_id, _, interval in due
+    }
+
+    shards = shard_rules(queries, settings.ALERT_SHARDS)
+    for shard, ids in sorted(shards.items()):
+        # A shard still queued when its rules are due again is superseded
+        evaluate_alert_shard.apply_async(
+            args=[shard, ids],
+            queue=settings.ALERT_QUEUE,
+            expires=min(intervals[rule_id] for rule_id in ids),
+        )
+    if queries:
+        print(f"Dispatched {len(queries)} alert rules in {len(shards)} shards")
+    return {"synced": synced, "due": len(queries), "shards": len(shards)}
+
+
+@celery_app.task(name="app.services.alert_service.evaluate_alert_shard")
+def evaluate_alert_shard(shard: int, rule_ids: List[int]):
+    """
+    Celery task to evaluate one shard of alert rules.
+    """
+    # Keep loaded rules and servers usable after the commit instead of reloading each one
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        # Rules may have been disabled or deleted since dispatch
+        rules = db.query(AlertRule).filter(
+            AlertRule.id.in_(rule_ids),
+            AlertRule.is_active == True,
+        ).all()
+
+        # Evaluate them all in one pass of the worker's event loop
+        stats = run_async(evaluate_alert_rules(db, rules, shard=shard))
+        print(
+            f"Shard {shard}: evaluated {stats['rules']} alert rules with {stats['queries']} queries "
+            f"in {stats['duration_seconds']:.2f}s "
+            f"({stats['rules_per_second']:.1f} rules/s, {stats['events']} events, {stats['failed']} failed)"
+        )
+        return stats
 
     finally:
         db.close()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from typing import Any, Dict, Iterable, Optional
+import redis.asyncio as redis
+
+STATE_PENDING = "pending"
+STATE_FIRING = "firing"
+
+# rule ID -> server ID -> {"state", "since", "value", "notified_at"}; resolved alerts have no entry
+RuleStates = Dict[int, Dict[int, Dict[str, Any]]]
+# rule ID -> server ID -> new state, or None to delete it
+StateUpdates = Dict[int, Dict[int, Optional[Dict[str, Any]]]]
+
+
+class MemoryAlertStateStore:
+    """
+    Alert state kept in the current process; lost on restart.
+    """
+
+    def __init__(self):
+        self._states: RuleStates = {}
+
+    async def load(self, rule_ids: Iterable[int]) -> RuleStates:
+        return {
+            rule_id: dict(self._states[rule_id])
+            for rule_id in rule_ids
+            if self._states.get(rule_id)
+        }
+
+    async def save(self, updates: StateUpdates) -> None:
+        for rule_id, changes in updates.items():
+            states = self._states.setdefault(rule_id, {})
+            for server_id, state in changes.items():
+                if state is None:
+                    states.pop(server_id, None)
+                else:
+                    states[server_id] = state
+            if not states:
+                del self._states[rule_id]
+
+    def clear(self) -> None:
+        self._states.clear()
+
+
+class RedisAlertStateStore:
+    """
+    Alert state shared by all workers through Redis, one hash per rule
+    (server ID -> JSON state). Each cycle reads and writes it with one
+    pipelined round trip; hashes of rules that stop being evaluated expire
+    after ttl seconds.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.url = url
+        self.ttl = ttl
+        self._client: Optional[redis.Redis] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> redis.Redis:
+        # Connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = redis.from_url(self.url)
+            self._client_loop = loop
+        return self._client
+
+    async def load(self, rule_ids: Iterable[int]) -> RuleStates:
+        rule_ids = list(rule_ids)
+        if not rule_ids:
+            return {}
+        pipe = self._get_client().pipeline(transaction=False)
+        for rule_id in rule_ids:
+            pipe.hgetall(_state_key(rule_id))
+        states = {}
+        for rule_id, fields in zip(rule_ids, await pipe.execute()):
+            if fields:
+                states[rule_id] = {int(server_id): json.loads(state) for server_id, state in fields.items()}
+        return states
+
+    async def save(self, updates: StateUpdates) -> None:
+        if not updates:
+            return
+        pipe = self._get_client().pipeline(transaction=False)
+        for rule_id, changes in updates.items():
+            key = _state_key(rule_id)
+            deleted = [server_id for server_id, state in changes.items() if state is None]
+            stored = {server_id: json.dumps(state) for server_id, state in changes.items() if state is not None}
+            if deleted:
+                pipe.hdel(key, *deleted)
+            if stored:
+                pipe.hset(key, mapping=stored)
+                pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+
+def _state_key(rule_id: int) -> str:
+    return f"vigil:alert-state:{rule_id}"
@@ -0,0 +1,76 @@
+from typing import Any, Dict, List, Optional
+from .series import iso_to_unix
+
+# Sec-WebSocket-Protocol value that opts a metrics socket in to delta frames
+DELTA_SUBPROTOCOL = "vigil.delta.msgpack"
+
+
+class DeltaEncoder:
+    """
+    Per-socket encoder for the delta protocol.
+
+    The first snapshot of each server is sent in full (with "full": true);
+    after that a server's entry carries only its id, timestamp and the
+    metrics whose value moved by more than epsilon since it was last sent.
+    Metrics that disappear are listed under "removed", and errors are only
+    included when they change. Values are compared with the last value sent,
+    not the last one seen, so a client's view never drifts by more than epsilon.
+    """
+
+    def __init__(self, epsilon: float = 0.0):
+        self.epsilon = epsilon
+        self._sent: Dict[int, Dict[str, Any]] = {}
+        self._errors: Dict[int, Dict[str, str]] = {}
+
+    def forget(self, server_id: int) -> None:
+        """
+        Drop a server's state, so its next snapshot is sent in full again.
+        """
+        self._sent.pop(server_id, None)
+        self._errors.pop(server_id, None)
+
+    def encode(self, snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encode one server snapshot against what the client already has.
+        """
+        server_id = snapshot["server_id"]
+        metrics = snapshot.get("metrics", {})
+        errors = snapshot.get("errors", {})
+        entry: Dict[str, Any] = {
+            "server_id": server_id,
+            "timestamp": iso_to_unix(snapshot.get("timestamp")),
+        }
+
+        sent = self._sent.get(server_id)
+        if sent is None:
+            self._sent[server_id] = dict(metrics)
+            self._errors[server_id] = dict(errors)
+            entry.update(full=True, server_name=snapshot.get("server_name"), metrics=metrics, errors=errors)
+            return entry
+
+        changed = {}
+        for name, value in metrics.items():
+            if name not in sent or self._moved(sent[name], value):
+                changed[name] = value
+                sent[name] = value
+        removed = [name for name in sent if name not in metrics]
+        for name in removed:
+            del sent[name]
+
+        if changed:
+            entry["metrics"] = changed
+        if removed:
+            entry["removed"] = removed
+        if errors != self._errors.get(server_id):
+            self._errors[server_id] = dict(errors)
+            entry["errors"] = errors
+        return entry
+
+    def encode_batch(self, snapshots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.encode(snapshot) for snapshot in snapshots]
+
+    def _moved(self, previous: Optional[float], value: Optional[float]) -> bool:
+        if previous is None or value is None:
+            return previous is not value
+        return abs(value - previous) > self.epsilon
+
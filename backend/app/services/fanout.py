@@ -0,0 +1,112 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, Optional, Set
+import redis.asyncio as redis
+
+CHANNEL_PREFIX = "vigil:metrics:"
+LEASE_PREFIX = "vigil:metrics-lease:"
+
+# Extend or release the lease only while this process still holds it
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisFanout:
+    """
+    Shares metric snapshots between API processes through Redis.
+
+    For each server, the processes that have local viewers compete for a
+    lease; only the holder polls Prometheus and publishes the snapshot to
+    the server's channel. Every process subscribes only to the channels of
+    the servers it has local viewers for and relays them to its own sockets,
+    so neither Prometheus load nor relay traffic grows with the number of
+    workers, pods or servers in the cluster.
+    A lease that is not renewed (holder gone or no longer watching) expires
+    and is taken over by another process on its next tick.
+    """
+
+    def __init__(self, url: str, lease_seconds: float):
+        self.lease_ms = int(lease_seconds * 1000)
+        self.token = uuid.uuid4().hex
+        self._redis = redis.from_url(url)
+        self._channels: Set[str] = set()
+        self._watching = asyncio.Event()
+        self._pubsub: Optional[redis.client.PubSub] = None
+
+    async def acquire(self, server_id: int) -> bool:
+        """
+        Take or renew the polling lease for a server.
+        """
+        key = f"{LEASE_PREFIX}{server_id}"
+        if await self._redis.set(key, self.token, nx=True, px=self.lease_ms):
+            return True
+        return bool(await self._redis.eval(RENEW_SCRIPT, 1, key, self.token, self.lease_ms))
+
+    async def release(self, server_id: int) -> None:
+        await self._redis.eval(RELEASE_SCRIPT, 1, f"{LEASE_PREFIX}{server_id}", self.token)
+
+    async def publish(self, server_id: int, snapshot: Dict[str, Any]) -> None:
+        await self._redis.publish(f"{CHANNEL_PREFIX}{server_id}", json.dumps(snapshot))
+
+    async def subscribe(self, server_id: int) -> None:
+        """
+        Start relaying a server's snapshots to this process.
+        """
+        channel = f"{CHANNEL_PREFIX}{server_id}"
+        self._channels.add(channel)
+        if self._pubsub is not None:
+            await self._pubsub.subscribe(channel)
+        self._watching.set()
+
+    async def unsubscribe(self, server_id: int) -> None:
+        channel = f"{CHANNEL_PREFIX}{server_id}"
+        self._channels.discard(channel)
+        if not self._channels:
+            self._watching.clear()
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(channel)
+
+    async def listen(self, callback: Callable[[int, Dict[str, Any]], None]) -> None:
+        """
+        Relay the snapshots of subscribed servers to callback(server_id, snapshot).
+        """
+        pubsub = self._redis.pubsub()
+        self._pubsub = pubsub
+        try:
+            if self._channels:
+                await pubsub.subscribe(*self._channels)
+            while True:
+                if not pubsub.subscribed:
+                    # Nothing to read until the first server is subscribed
+                    await self._watching.wait()
+                    continue
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None or message["type"] != "message":
+                    continue
+                try:
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    server_id = int(channel[len(CHANNEL_PREFIX):])
+                    snapshot = json.loads(message["data"])
+                except ValueError as e:
+                    print(f"Ignoring malformed metrics message: {e}")
+                    continue
+                callback(server_id, snapshot)
+        finally:
+            self._pubsub = None
+            await asyncio.shield(pubsub.aclose())
+
+    async def close(self) -> None:
+        await self._redis.aclose()
@@ -0,0 +1,280 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from prometheus_client import Counter, Gauge
+from ..core import settings
+from .fanout import RedisFanout
+from .prometheus_service import prometheus_service
+from .recent_samples import RecentSamples, recent_samples
+from .server_registry import ServerInfo, ServerRegistry, server_registry
+
+ws_pending_snapshots = Gauge(
+    "vigil_ws_pending_snapshots",
+    "Snapshots waiting to be sent across all metric sockets.",
+)
+ws_dropped_snapshots = Counter(
+    "vigil_ws_dropped_snapshots_total",
+    "Snapshots replaced by a newer one before a slow socket could send them.",
+)
+ws_slow_consumer_disconnects = Counter(
+    "vigil_ws_slow_consumer_disconnects_total",
+    "Metric sockets closed because sends stayed blocked past the threshold.",
+)
+
+
+class SlowConsumer(Exception):
+    """
+    Raised when a socket stays behind for longer than the slow-consumer threshold.
+    """
+
+
+class Subscriber:
+    """
+    One socket's view of the hub: the latest undelivered snapshot for each
+    server it is subscribed to, so a batch never holds more than one
+    snapshot per server.
+
+    This is the socket's outbound queue. It is bounded by the number of
+    subscribed servers: a snapshot that is still pending when the next one
+    arrives is stale and is replaced, so a slow client falls behind by at
+    most one snapshot per server and never slows the hub or other sockets.
+    """
+
+    def __init__(self):
+        self.server_ids: Set[int] = set()
+        self.last_tick: Optional[int] = None
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._ready = asyncio.Event()
+
+    def deliver(self, server_id: int, snapshot: Dict[str, Any]) -> None:
+        if server_id not in self.server_ids:
+            return
+        if server_id in self._pending:
+            ws_dropped_snapshots.inc()
+        else:
+            ws_pending_snapshots.inc()
+        self._pending[server_id] = snapshot
+        self._ready.set()
+
+    def discard(self, server_id: int) -> None:
+        """
+        Drop a pending snapshot of a server that is no longer watched.
+        """
+        if self._pending.pop(server_id, None) is not None:
+            ws_pending_snapshots.dec()
+        if not self._pending:
+            self._ready.clear()
+
+    async def wait(self) -> None:
+        """
+        Wait until at least one snapshot is pending.
+        """
+        await self._ready.wait()
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """
+        Take every pending snapshot.
+        """
+        batch = list(self._pending.values())
+        ws_pending_snapshots.dec(len(batch))
+        self._pending.clear()
+        self._ready.clear()
+        return batch
+
+
+class MetricsHub:
+    """
+    Fan-out of live server metrics to WebSocket subscribers.
+
+    Runs exactly one poller per watched server: it starts with the first
+    subscriber, broadcasts every snapshot to all subscribers of that server
+    and stops when the last one leaves, so Prometheus load grows with the
+    number of distinct servers watched rather than the number of sockets.
+    Pollers are aligned to interval boundaries so that snapshots for
+    different servers arrive together and can be batched per socket.
+
+    With a Redis fanout, pollers only query Prometheus while they hold the
+    server's lease and publish to Redis instead; each poller also subscribes
+    its process to the server's channel for as long as it runs, so processes
+    relay only the snapshots of servers they have local subscribers for.
+
+    With a registry, pollers re-read the server's metadata from it on every
+    tick, so changes to its instance or is_active apply without restarting
+    the stream; inactive or deleted servers are not polled.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        fanout: Optional[RedisFanout] = None,
+        samples: Optional[RecentSamples] = None,
+        registry: Optional[ServerRegistry] = None,
+    ):
+        self.interval = interval
+        self.fanout = fanout
+        self.samples = samples
+        self.registry = registry
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._pollers: Dict[int, asyncio.Task] = {}
+        self._relay: Optional[asyncio.Task] = None
+
+    def subscribe(self, server: ServerInfo, subscriber: Subscriber) -> None:
+        """
+        Subscribe to a server's snapshots, starting its poller if needed.
+        """
+        self._subscribers.setdefault(server.id, set()).add(subscriber)
+        subscriber.server_ids.add(server.id)
+        if self.fanout is not None and self._relay is None:
+            self._relay = asyncio.ensure_future(self._run_relay())
+        if server.id not in self._pollers:
+            self._pollers[server.id] = asyncio.ensure_future(
+                self._poll(server)
+            )
+
+    def unsubscribe(self, server_id: int, subscriber: Subscriber) -> None:
+        """
+        Remove a subscriber, stopping the server's poller after the last one.
+        """
+        subscriber.server_ids.discard(server_id)
+        subscriber.discard(server_id)
+        subscribers = self._subscribers.get(server_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[server_id]
+            poller = self._pollers.pop(server_id, None)
+            if poller is not None:
+                poller.cancel()
+
+    def unsubscribe_all(self, subscriber: Subscriber) -> None:
+        for server_id in list(subscriber.server_ids):
+            self.unsubscribe(server_id, subscriber)
+        subscriber.drain()
+
+    def subscriber_count(self, server_id: int) -> int:
+        return len(self._subscribers.get(server_id, ()))
+
+    @property
+    def polled_servers(self) -> Set[int]:
+        return set(self._pollers)
+
+    async def next_batch(self, subscriber: Subscriber, window: float) -> List[Dict[str, Any]]:
+        """
+        Wait for the subscriber's next batch of snapshots.
+
+        Collects for `window` seconds after the first snapshot of a tick so
+        the aligned pollers' results share one frame, and never returns two
+        batches within the same interval.
+        """
+        while True:
+            await subscriber.wait()
+            await asyncio.sleep(window)
+            tick = int(time.time() // self.interval)
+            if tick == subscriber.last_tick:
+                # A late snapshot for a tick already sent waits for the next one
+                await asyncio.sleep((tick + 1) * self.interval + window - time.time())
+                tick += 1
+            subscriber.last_tick = tick
+            batch = subscriber.drain()
+            if batch:
+                return batch
+
+    async def close(self) -> None:
+        """
+        Stop every poller and the Redis relay.
+        """
+        tasks = list(self._pollers.values())
+        if self._relay is not None:
+            tasks.append(self._relay)
+            self._relay = None
+        self._pollers.clear()
+        self._subscribers.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.fanout is not None:
+            await self.fanout.close()
+
+    async def _poll(self, server: ServerInfo) -> None:
+        server_id = server.id
+        try:
+            if self.fanout is not None:
+                try:
+                    await self.fanout.subscribe(server_id)
+                except Exception as e:
+                    # The relay subscribes again when it reconnects
+                    print(f"Error subscribing to metrics of server {server_id}: {e}")
+            while True:
+                try:
+                    if self.registry is not None:
+                        server = await self.registry.get(server_id)
+                    if server is not None and server.is_active and (
+                        self.fanout is None or await self.fanout.acquire(server_id)
+                    ):
+                        metrics, errors = await prometheus_service.get_server_metrics(
+                            job_name=server.job_name,
+                            instance=server.instance
+                        )
+                        snapshot = {
+                            "server_id": server_id,
+                            "server_name": server.name,
+                            "timestamp": datetime.utcnow().isoformat(),
+                            "metrics": metrics,
+                            "errors": errors,
+                        }
+                        if self.fanout is None:
+                            self._broadcast(server_id, snapshot)
+                        else:
+                            await self.fanout.publish(server_id, snapshot)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Error polling metrics for server {server_id}: {e}")
+
+                await asyncio.sleep(self.interval - time.time() % self.interval)
+        finally:
+            if self.fanout is not None:
+                try:
+                    await self.fanout.unsubscribe(server_id)
+                except Exception as e:
+                    print(f"Error unsubscribing from metrics of server {server_id}: {e}")
+                try:
+                    await self.fanout.release(server_id)
+                except Exception as e:
+                    print(f"Error releasing metrics lease for server {server_id}: {e}")
+
+    async def _run_relay(self) -> None:
+        while True:
+            try:
+                await self.fanout.listen(self._broadcast)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error relaying metrics from Redis: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _broadcast(self, server_id: int, snapshot: Dict[str, Any]) -> None:
+        if self.samples is not None:
+            self.samples.record(snapshot)
+        for subscriber in list(self._subscribers.get(server_id, ())):
+            subscriber.deliver(server_id, snapshot)
+
+
+def _create_fanout() -> Optional[RedisFanout]:
+    """
+    Build the cross-process fanout for the configured backend.
+    """
+    if settings.WS_FANOUT_BACKEND == "redis":
+        # Outlive a missed renewal or two before another process takes over
+        return RedisFanout(settings.REDIS_URL, lease_seconds=3 * settings.WS_METRICS_INTERVAL_SECONDS)
+    return None
+
+
+metrics_hub = MetricsHub(
+    interval=settings.WS_METRICS_INTERVAL_SECONDS,
+    fanout=_create_fanout(),
+    samples=recent_samples,
+    registry=server_registry,
+)
@@ -1,100 +1,594 @@
+import asyncio
+import math
+import re
+import time
 import httpx
-from typing import Dict, Any, Optional
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from ..core import settings
+from .query_cache import QueryCache
+from .range_cache import MemoryBlockStore, RangeCache, RedisBlockStore
+from .response_stream import ResultStreamParser
+from .resilience import AdaptiveLimiter, CircuitBreaker
+from .series import SeriesColumns
+
+# Summary metrics keyed by name. Every expression is aggregated by (job, instance),
+# so the same PromQL serves a single server or the whole fleet depending on the
+# label selector substituted for {selector}.
+SERVER_METRIC_QUERIES = {
+    "cpu_usage_percent": '100 - (avg by (job, instance) (irate(node_cpu_seconds_total{{mode="idle",{selector}}}[5m])) * 100)',
+    "memory_usage_percent": '(1 - (sum by (job, instance) (node_memory_MemAvailable_bytes{{{selector}}}) / sum by (job, instance) (node_memory_MemTotal_bytes{{{selector}}}))) * 100',
+    "disk_usage_percent": '100 - ((sum by (job, instance) (node_filesystem_avail_bytes{{mountpoint="/",fstype!="rootfs",{selector}}}) * 100) / sum by (job, instance) (node_filesystem_size_bytes{{mountpoint="/",fstype!="rootfs",{selector}}}))',
+    "network_rx_bytes_per_sec": 'sum by (job, instance) (rate(node_network_receive_bytes_total{{device!="lo",{selector}}}[5m]))',
+    "network_tx_bytes_per_sec": 'sum by (job, instance) (rate(node_network_transmit_bytes_total{{device!="lo",{selector}}}[5m]))',
+}
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escape a value for use inside a double-quoted PromQL label matcher.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def label_selector(**labels: str) -> str:
+    """
+    Build the inside of a PromQL label selector, e.g. job="node",instance="host:9100".
+    """
+    return ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items())
+
+
+# String literals, which must be kept byte for byte, and comments (to end of line)
+PROMQL_TOKEN = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|`[^`]*`)|#[^\n]*')
+
+
+def normalize_promql(query: str) -> str:
+    """
+    Canonical form of a PromQL expression, so that queries differing only in
+    whitespace or comments compare equal: comments are dropped, runs of
+    whitespace outside string literals become one space and whitespace
+    around brackets and commas is dropped.
+
+    Only meant for comparing queries: send the original expression to Prometheus.
+    """
+    # Code and string literals alternate, starting with code
+    parts = [""]
+    position = 0
+    for match in PROMQL_TOKEN.finditer(query):
+        parts[-1] += query[position:match.start()]
+        if match.group(1):
+            parts += [match.group(1), ""]
+        else:
+            parts[-1] += " "
+        position = match.end()
+    parts[-1] += query[position:]
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i])
+        parts[i] = re.sub(r" ?([(){}\[\],]) ?", r"\1", part)
+    return "".join(parts).strip()
+
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+
+def parse_duration(value: Union[str, float]) -> float:
+    """
+    Parse a Prometheus duration ("15s", "1h30m") or a number of seconds.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w|y)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        raise ValueError(f"Invalid duration: {value}")
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_timestamp(value: Union[str, float]) -> float:
+    """
+    Parse a Prometheus timestamp (unix seconds or RFC 3339) to unix seconds.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def compute_step(start: float, end: float, max_points: int) -> int:
+    """
+    Smallest whole-second step that keeps a range query within max_points
+    samples per series, never finer than the scrape interval.
+    """
+    window = max(end - start, 0.0)
+    step = math.ceil(window / max(max_points - 1, 1))
+    return max(step, math.ceil(settings.PROMETHEUS_SCRAPE_INTERVAL_SECONDS), 1)
+
+
+async def first_value(series: AsyncIterator[Dict[str, Any]]) -> Optional[float]:
+    """
+    Reduce an instant vector to the value of its first sample.
+    """
+    async for item in series:
+        try:
+            return float(item["value"][1])
+        except (IndexError, ValueError, KeyError):
+            return None
+    return None
+
+
+async def values_by_instance(series: AsyncIterator[Dict[str, Any]]) -> Dict[Tuple[str, str], float]:
+    """
+    Reduce an instant vector to {(job, instance): value}, one series at a time.
+    """
+    values: Dict[Tuple[str, str], float] = {}
+    async for item in series:
+        labels = item.get("metric", {})
+        try:
+            values[(labels.get("job"), labels.get("instance"))] = float(item["value"][1])
+        except (IndexError, ValueError, KeyError):
+            continue
+    return values
+
+
+class PrometheusError(Exception):
+    """
+    Raised when Prometheus answers with a non-success status.
+    """
+
+
+class PrometheusUnavailable(PrometheusError):
+    """
+    Raised without contacting Prometheus while the circuit breaker is open.
+    """
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """
+    Whether an error means Prometheus is unhealthy (as opposed to a bad query).
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
 
 
 class PrometheusService:
     def __init__(self):
         self.base_url = settings.PROMETHEUS_URL
+        self.timeout = settings.PROMETHEUS_TIMEOUT_SECONDS
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        cache_ttl = settings.PROMQL_CACHE_TTL_SECONDS
+        if cache_ttl is None:
+            cache_ttl = settings.PROMETHEUS_SCRAPE_INTERVAL_SECONDS
+        self.cache = QueryCache(max_entries=settings.PROMQL_CACHE_MAX_ENTRIES, ttl=cache_ttl)
+        self.range_cache = self._create_range_cache()
+        # Latest value per query, served while the circuit breaker is open
+        self.last_known = QueryCache(max_entries=settings.PROMQL_CACHE_MAX_ENTRIES, ttl=math.inf)
+        self.limiter = AdaptiveLimiter(
+            initial_limit=settings.PROMETHEUS_CONCURRENCY_INITIAL,
+            min_limit=settings.PROMETHEUS_CONCURRENCY_MIN,
+            max_limit=settings.PROMETHEUS_CONCURRENCY_MAX,
+            latency_target=settings.PROMETHEUS_LATENCY_TARGET_SECONDS,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.PROMETHEUS_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.PROMETHEUS_BREAKER_RESET_SECONDS,
+        )
 
-    async def query(self, query: str) -> Optional[Dict[str, Any]]:
+    def _create_range_cache(self) -> Optional[RangeCache]:
         """
-        Execute a PromQL query and return results.
+        Build the range query block cache for the configured backend.
         """
-        url = f"{self.base_url}/api/v1/query"
-        params = {"query": query}
+        backend = settings.PROMQL_RANGE_CACHE_BACKEND
+        if backend == "memory":
+            store = MemoryBlockStore(max_bytes=settings.PROMQL_RANGE_CACHE_MAX_BYTES)
+        elif backend == "redis":
+            store = RedisBlockStore(settings.REDIS_URL, ttl=settings.PROMQL_RANGE_CACHE_REDIS_TTL_SECONDS)
+        else:
+            return None
+        return RangeCache(
+            store,
+            block_seconds=settings.PROMQL_RANGE_CACHE_BLOCK_SECONDS,
+            freshness_seconds=settings.PROMQL_RANGE_CACHE_FRESHNESS_SECONDS,
+        )
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """
+        Build the pooled HTTP client shared by all queries.
+        """
+        limits = httpx.Limits(
+            max_connections=settings.PROMETHEUS_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.PROMETHEUS_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.PROMETHEUS_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        try:
+            return httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=limits,
+                http2=settings.PROMETHEUS_HTTP2,
+            )
+        except ImportError:
+            print("HTTP/2 requested for Prometheus but 'h2' is not installed, using HTTP/1.1")
+            return httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Return the shared client, creating it if needed.
+
+        Pooled connections belong to the event loop that opened them, so a
+        client created under a different (e.g. already closed) loop is replaced.
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = self._create_client()
+            self._client_loop = loop
+        return self._client
+
+    async def start(self) -> None:
+        """
+        Open the shared HTTP client. Called from the app and worker startup hooks.
+        """
+        self._get_client()
+
+    async def close(self) -> None:
+        """
+        Close the shared HTTP client and release its pooled connections.
+        """
+        client = self._client
+        self._client = None
+        self._client_loop = None
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+    async def _stream(
+        self,
+        path: str,
+        params: Dict[str, Any],
+        timeout: Optional[float] = None,
+        envelope: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Call the Prometheus HTTP API and yield the elements of data.result one
+        at a time as they are parsed from the response stream.
+
+        The rest of the response is copied into envelope, if given, once the
+        body has been read. Raises PrometheusError when the body exceeds
+        PROMETHEUS_MAX_RESPONSE_BYTES or Prometheus reports a failure, and
+        PrometheusUnavailable while the circuit breaker is open.
+
+        Requests are admitted by the adaptive concurrency limiter; their
+        latency and outcome feed both the limiter and the circuit breaker.
+        """
+        if not self.breaker.allow():
+            raise PrometheusUnavailable("Prometheus circuit breaker is open")
+
+        client = self._get_client()
+        parser = ResultStreamParser()
+        received = 0
+        outcome = None
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.record_aborted()
+            raise
+        started = time.monotonic()
+        try:
+            async with client.stream(
+                "GET",
+                path,
+                params=params,
+                timeout=timeout if timeout is not None else self.timeout,
+            ) as response:
                 response.raise_for_status()
-                data = response.json()
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > settings.PROMETHEUS_MAX_RESPONSE_BYTES:
+                        raise PrometheusError(
+                            f"Prometheus response exceeds {settings.PROMETHEUS_MAX_RESPONSE_BYTES} bytes"
+                        )
+                    for item in parser.feed(chunk):
+                        yield item
+            outcome = "success"
+        except Exception as e:
+            outcome = "failure" if is_upstream_failure(e) else "success"
+            raise
+        finally:
+            # A stream closed early by its consumer still answered in time
+            self.limiter.release(time.monotonic() - started, ok=outcome != "failure")
+            if outcome == "failure":
+                self.breaker.record_failure()
+            elif outcome == "success" or received:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_aborted()
+
+        for item in parser.finish():
+            yield item
+
+        if parser.envelope.get("status") != "success":
+            raise PrometheusError(parser.envelope.get("error", "Prometheus query failed"))
+        if envelope is not None:
+            envelope.update(parser.envelope)
+
+    async def _request(
+        self,
+        path: str,
+        params: Dict[str, Any],
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Call the Prometheus HTTP API and return the "data" payload.
+
+        Raises PrometheusError (or the underlying httpx error) on failure.
+        """
+        envelope: Dict[str, Any] = {}
+        result = [item async for item in self._stream(path, params, timeout, envelope)]
+        data = envelope.get("data")
+        if isinstance(data, dict) and "result" in data:
+            data["result"] = result
+        return data
+
+    async def _fetch_series(
+        self,
+        path: str,
+        params: Dict[str, Any],
+        timeout: Optional[float] = None,
+    ) -> List[SeriesColumns]:
+        """
+        Call a matrix endpoint of the Prometheus HTTP API and convert each
+        series to columns as soon as it is parsed, so the per-sample lists of
+        only one series exist at a time.
+        """
+        return [
+            SeriesColumns.from_samples(item.get("metric", {}), item.get("values", []))
+            async for item in self._stream(path, params, timeout)
+        ]
+
+    async def _query(
+        self,
+        query: str,
+        timeout: Optional[float] = None,
+        reduce: Optional[Callable[[AsyncIterator[Dict[str, Any]]], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        Execute an instant query through the result cache.
+
+        The evaluation time is aligned down to the cache TTL, so every caller in
+        the same window shares one cached result and concurrent identical
+        queries share one upstream request.
+
+        With reduce, the result series are streamed into reduce() and only its
+        return value is cached instead of the full result.
+
+        While the circuit breaker is open the last known value is returned,
+        if there is one.
+        """
+        ttl = self.cache.ttl
+        params: Dict[str, Any] = {"query": query}
+        if ttl > 0:
+            params["time"] = math.floor(time.time() / ttl) * ttl
+
+        async def load() -> Any:
+            if reduce is None:
+                return await self._request("/api/v1/query", params, timeout)
+            stream = self._stream("/api/v1/query", params, timeout)
+            try:
+                return await reduce(stream)
+            finally:
+                await stream.aclose()
+
+        reducer = reduce.__name__ if reduce else None
+        try:
+            if ttl <= 0:
+                value = await load()
+            else:
+                value = await self.cache.get_or_load((query, params["time"], reducer), load)
+        except PrometheusUnavailable:
+            value = self.last_known.get((query, reducer))
+            if value is None:
+                raise
+            return value
+
+        if value is not None:
+            self.last_known.set((query, reducer), value)
+        return value
+
+    async def iter_query(self, query: str, timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Execute a PromQL query and yield result series one at a time.
+
+        Results are not cached and errors are raised to the caller.
+        """
+        stream = self._stream("/api/v1/query", {"query": query}, timeout)
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
 
-                if data.get("status") == "success":
-                    return data.get("data")
-                return None
+    async def query(self, query: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Execute a PromQL query and return results.
+        """
+        try:
+            return await self._query(query, timeout)
         except Exception as e:
             print(f"Error querying Prometheus: {e}")
             return None
 
+    async def _fetch_range(
+        self,
+        query: str,
+        start: float,
+        end: float,
+        step: float,
+        timeout: Optional[float] = None,
+    ) -> List[SeriesColumns]:
+        """
+        Execute a range query against Prometheus, bypassing the cache.
+
+        Windows longer than PROMQL_RANGE_SHARD_SECONDS are split into
+        step-aligned shards that run concurrently and are merged per series,
+        giving the same samples as one unsharded query.
+        """
+        def params(start: float, end: float) -> Dict[str, Any]:
+            return {
+                "query": query,
+                "start": start,
+                "end": end,
+                "step": step,
+            }
+
+        shard_seconds = settings.PROMQL_RANGE_SHARD_SECONDS
+        if shard_seconds <= 0 or end - start <= shard_seconds:
+            return await self._fetch_series("/api/v1/query_range", params(start, end), timeout)
+
+        # Every shard starts on the unsharded evaluation grid (start + k * step)
+        shard_span = math.ceil(shard_seconds / step) * step
+        shard_count = math.floor((end - start) / shard_span) + 1
+        semaphore = asyncio.Semaphore(settings.PROMQL_RANGE_SHARD_CONCURRENCY)
+
+        async def fetch_shard(index: int) -> List[SeriesColumns]:
+            shard_start = start + index * shard_span
+            shard_end = min(shard_start + shard_span - step, end)
+            async with semaphore:
+                return await self._fetch_series("/api/v1/query_range", params(shard_start, shard_end), timeout)
+
+        shards = await asyncio.gather(*(fetch_shard(index) for index in range(shard_count)))
+
+        merged: Dict[Tuple[Tuple[str, str], ...], SeriesColumns] = {}
+        for shard in shards:
+            for series in shard:
+                key = tuple(sorted(series.labels.items()))
+                if key in merged:
+                    merged[key].extend(series)
+                else:
+                    merged[key] = series
+
+        return [merged[key] for key in sorted(merged)]
+
     async def query_range(
         self,
         query: str,
-        start: str,
-        end: str,
-        step: str = "15s"
-    ) -> Optional[Dict[str, Any]]:
-        """
-        Execute a PromQL range query.
-        """
-        url = f"{self.base_url}/api/v1/query_range"
-        params = {
-            "query": query,
-            "start": start,
-            "end": end,
-            "step": step,
-        }
+        start: Union[str, float],
+        end: Union[str, float],
+        step: Union[str, float] = "15s",
+        timeout: Optional[float] = None,
+    ) -> Optional[List[SeriesColumns]]:
+        """
+        Execute a PromQL range query and return its series in columnar form.
 
+        Completed, step-aligned blocks are served from the range cache so only
+        the missing part of the window is requested from Prometheus.
+        """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
+            start_ts, end_ts, step_sec = parse_timestamp(start), parse_timestamp(end), parse_duration(step)
+            if self.range_cache is None or step_sec <= 0:
+                return await self._fetch_range(query, start_ts, end_ts, step_sec, timeout)
 
-                if data.get("status") == "success":
-                    return data.get("data")
-                return None
+            async def fetch(query: str, start: float, end: float, step: float) -> List[SeriesColumns]:
+                return await self._fetch_range(query, start, end, step, timeout)
+
+            return await self.range_cache.query(query, start_ts, end_ts, step_sec, fetch)
         except Exception as e:
             print(f"Error querying Prometheus range: {e}")
             return None
 
-    async def get_server_metrics(self, job_name: str, instance: str) -> Dict[str, Any]:
+    async def _run_metric_queries(
+        self,
+        selector: str,
+        reduce: Callable[[AsyncIterator[Dict[str, Any]]], Awaitable[Any]],
+        deadline: Optional[float] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Run every summary metric query concurrently under one overall deadline.
+
+        Returns the reduced results that completed and, separately, the
+        metrics that timed out or failed, so callers can serve partial data.
+        """
+        deadline = deadline if deadline is not None else settings.PROMETHEUS_METRICS_DEADLINE_SECONDS
+        tasks = {
+            asyncio.ensure_future(
+                self._query(template.format(selector=selector), deadline, reduce=reduce)
+            ): name
+            for name, template in SERVER_METRIC_QUERIES.items()
+        }
+
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+
+        results: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        for task, name in tasks.items():
+            if task in pending:
+                errors[name] = "timeout"
+            elif task.exception() is not None:
+                print(f"Error querying Prometheus for {name}: {task.exception()}")
+                errors[name] = "error"
+            else:
+                results[name] = task.result()
+
+        return results, errors
+
+    async def get_server_metrics(
+        self,
+        job_name: str,
+        instance: str,
+    ) -> Tuple[Dict[str, Any], Dict[str, str]]:
         """
         Get common metrics for a server.
+
+        Returns (metrics, errors) where errors maps each metric that timed out
+        or failed to "timeout" or "error".
+        """
+        selector = label_selector(job=job_name, instance=instance)
+        results, errors = await self._run_metric_queries(selector, first_value)
+
+        metrics = {name: value for name, value in results.items() if value is not None}
+        return metrics, errors
+
+    async def get_fleet_metrics(self) -> Tuple[Dict[Tuple[str, str], Dict[str, Any]], Dict[str, str]]:
+        """
+        Get common metrics for every instance at once, keyed by (job, instance).
+
+        Runs one query per metric regardless of the number of servers and
+        returns (fleet, errors) like get_server_metrics.
+        """
+        fleet: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        results, errors = await self._run_metric_queries("", values_by_instance)
+
+        for name, values in results.items():
+            for key, value in values.items():
+                fleet.setdefault(key, {})[name] = value
+
+        return fleet, errors
+
+    async def get_server_metric_history(
+        self,
+        job_name: str,
+        instance: str,
+        metric: str,
+        start: float,
+        end: float,
+        max_points: int,
+    ) -> Tuple[Optional[List[SeriesColumns]], int]:
+        """
+        Get the history of one summary metric for a server as columnar series.
+
+        The step is derived from the window so that no series exceeds
+        max_points samples. Returns (series, step), with series set to None
+        when Prometheus could not be queried.
         """
-        metrics = {}
-
-        # CPU usage
-        cpu_query = f'100 - (avg by(instance) (irate(node_cpu_seconds_total{{mode="idle",job="{job_name}",instance="{instance}"}}[5m])) * 100)'
-        cpu_result = await self.query(cpu_query)
-        if cpu_result and cpu_result.get("result"):
-            metrics["cpu_usage_percent"] = float(cpu_result["result"][0]["value"][1])
-
-        # Memory usage
-        memory_query = f'(1 - (node_memory_MemAvailable_bytes{{job="{job_name}",instance="{instance}"}} / node_memory_MemTotal_bytes{{job="{job_name}",instance="{instance}"}})) * 100'
-        memory_result = await self.query(memory_query)
-        if memory_result and memory_result.get("result"):
-            metrics["memory_usage_percent"] = float(memory_result["result"][0]["value"][1])
-
-        # Disk usage
-        disk_query = f'100 - ((node_filesystem_avail_bytes{{job="{job_name}",instance="{instance}",mountpoint="/",fstype!="rootfs"}} * 100) / node_filesystem_size_bytes{{job="{job_name}",instance="{instance}",mountpoint="/",fstype!="rootfs"}})'
-        disk_result = await self.query(disk_query)
-        if disk_result and disk_result.get("result"):
-            metrics["disk_usage_percent"] = float(disk_result["result"][0]["value"][1])
-
-        # Network bytes received
-        network_rx_query = f'rate(node_network_receive_bytes_total{{job="{job_name}",instance="{instance}"}}[5m])'
-        network_rx_result = await self.query(network_rx_query)
-        if network_rx_result and network_rx_result.get("result"):
-            metrics["network_rx_bytes_per_sec"] = float(network_rx_result["result"][0]["value"][1])
-
-        # Network bytes transmitted
-        network_tx_query = f'rate(node_network_transmit_bytes_total{{job="{job_name}",instance="{instance}"}}[5m])'
-        network_tx_result = await self.query(network_tx_query)
-        if network_tx_result and network_tx_result.get("result"):
-            metrics["network_tx_bytes_per_sec"] = float(network_tx_result["result"][0]["value"][1])
-
-        return metrics
+        query = SERVER_METRIC_QUERIES[metric].format(
+            selector=label_selector(job=job_name, instance=instance)
+        )
+        step = compute_step(start, end, max_points)
+        series = await self.query_range(query, start=str(start), end=str(end), step=f"{step}s")
+        return series, step
 
 
 prometheus_service = PrometheusService()
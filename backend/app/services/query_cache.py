@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from prometheus_client import Counter
+
+promql_cache_requests = Counter(
+    "vigil_promql_cache_requests_total",
+    "PromQL result cache lookups by outcome (hit, miss, coalesced).",
+    ["result"],
+)
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with per-entry TTL and single-flight loading.
+
+    Concurrent lookups of a key that is already being loaded wait for the
+    same upstream call instead of issuing their own.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return a fresh cached value, or None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries over the bound.
+        """
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, loading it once if missing.
+
+        Failed loads are not cached and are raised to every waiter.
+        """
+        value = self.get(key)
+        if value is not None:
+            promql_cache_requests.labels(result="hit").inc()
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            promql_cache_requests.labels(result="coalesced").inc()
+        else:
+            promql_cache_requests.labels(result="miss").inc()
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        # Shield the shared load so one cancelled waiter doesn't cancel it for the rest
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter was cancelled
+            task.exception()
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await loader()
+        if value is not None:
+            self.set(key, value)
+        return value
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import msgpack
+import redis.asyncio as redis
+from prometheus_client import Counter
+from .series import SeriesColumns, pack
+
+# Samples of one block keyed by series (canonical JSON of its labels)
+Block = Dict[str, SeriesColumns]
+
+# Blocks always hold at least this many steps so coarse steps over long windows
+# don't degenerate into thousands of tiny blocks.
+MIN_BLOCK_SAMPLES = 60
+
+range_cache_blocks = Counter(
+    "vigil_promql_range_cache_blocks_total",
+    "Range query cache block lookups by outcome (hit, miss).",
+    ["result"],
+)
+
+
+def series_key(labels: Dict[str, str]) -> str:
+    return json.dumps(labels, sort_keys=True, separators=(",", ":"))
+
+
+def block_size(block: Block) -> int:
+    """
+    Approximate memory held by a block: its float64 columns plus label keys.
+    """
+    return sum(series.nbytes + len(key) for key, series in block.items())
+
+
+class MemoryBlockStore:
+    """
+    In-process block store bounded by an approximate memory budget (LRU).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._blocks: "OrderedDict[str, Tuple[int, Block]]" = OrderedDict()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Block]]:
+        blocks = []
+        for key in keys:
+            entry = self._blocks.get(key)
+            if entry is None:
+                blocks.append(None)
+                continue
+            self._blocks.move_to_end(key)
+            blocks.append(entry[1])
+        return blocks
+
+    async def set_many(self, items: Dict[str, Block]) -> None:
+        for key, block in items.items():
+            size = block_size(block)
+            if size > self.max_bytes:
+                continue
+            previous = self._blocks.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous[0]
+            self._blocks[key] = (size, block)
+            self.size_bytes += size
+        while self.size_bytes > self.max_bytes and self._blocks:
+            _, (size, _) = self._blocks.popitem(last=False)
+            self.size_bytes -= size
+
+
+class RedisBlockStore:
+    """
+    Block store shared by all processes through Redis. Blocks are stored as
+    msgpack with float64 byte columns; entries expire after ttl seconds and
+    the memory budget is enforced by Redis' maxmemory policy.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.ttl = ttl
+        self._redis = redis.from_url(url)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Block]]:
+        if not keys:
+            return []
+        values = await self._redis.mget(keys)
+        return [
+            {
+                key: SeriesColumns.from_msgpack_dict(series)
+                for key, series in msgpack.unpackb(value, raw=False).items()
+            }
+            if value is not None else None
+            for value in values
+        ]
+
+    async def set_many(self, items: Dict[str, Block]) -> None:
+        if not items:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for key, block in items.items():
+            pipe.set(key, pack({name: series.to_msgpack_dict() for name, series in block.items()}), ex=self.ttl)
+        await pipe.execute()
+
+
+class RangeCache:
+    """
+    Incremental cache for range query results.
+
+    Requests are aligned to the step and split into fixed blocks of whole
+    steps. Completed blocks (older than the freshness window) are stored, so
+    repeating a query like "last 6h" only asks Prometheus for the missing
+    blocks, which is usually just the tail.
+    """
+
+    def __init__(self, store, block_seconds: float, freshness_seconds: float):
+        self.store = store
+        self.block_seconds = block_seconds
+        self.freshness_seconds = freshness_seconds
+
+    def block_span(self, step: float) -> float:
+        return step * max(math.ceil(self.block_seconds / step), MIN_BLOCK_SAMPLES)
+
+    @staticmethod
+    def _key(query: str, step: float, block_start: float) -> str:
+        digest = hashlib.sha1(query.encode()).hexdigest()
+        return f"vigil:promql:range:{digest}:{step:g}:{block_start:.3f}"
+
+    async def query(
+        self,
+        query: str,
+        start: float,
+        end: float,
+        step: float,
+        fetch: Callable[[str, float, float, float], Awaitable[Optional[List[SeriesColumns]]]],
+    ) -> Optional[List[SeriesColumns]]:
+        """
+        Serve a range query from cached blocks, fetching only the missing ones.
+
+        fetch(query, start, end, step) must return the columnar series of a
+        matrix query, or None on failure.
+        """
+        start = math.floor(start / step) * step
+        end = math.floor(end / step) * step
+        span = self.block_span(step)
+        complete_before = time.time() - self.freshness_seconds
+
+        block_starts = [
+            index * span
+            for index in range(math.floor(start / span), math.floor(end / span) + 1)
+        ]
+
+        cacheable = [b for b in block_starts if b + span <= complete_before]
+        cached = dict(zip(cacheable, await self.store.get_many(
+            [self._key(query, step, b) for b in cacheable]
+        )))
+        blocks: Dict[float, Block] = {b: block for b, block in cached.items() if block is not None}
+        range_cache_blocks.labels(result="hit").inc(len(blocks))
+        range_cache_blocks.labels(result="miss").inc(len(block_starts) - len(blocks))
+
+        # Fetch each run of consecutive missing blocks with one upstream query
+        runs: List[List[float]] = []
+        previous_missing = False
+        for b in block_starts:
+            missing = b not in blocks
+            if missing and previous_missing:
+                runs[-1].append(b)
+            elif missing:
+                runs.append([b])
+            previous_missing = missing
+
+        to_store: Dict[str, Block] = {}
+        for run in runs:
+            # Whole blocks are fetched when they can be stored, at both ends of the
+            # run; the open tail only needs the requested part
+            run_start = run[0] if run[0] + span <= complete_before else max(run[0], start)
+            run_end = run[-1] + span - step if run[-1] + span <= complete_before else end
+            result = await fetch(query, run_start, run_end, step)
+            if result is None:
+                return None
+            fetched: Dict[float, Block] = {b: {} for b in run}
+            for series in result:
+                key = series_key(series.labels)
+                for b in run:
+                    part = series.slice_time(b, b + span)
+                    if len(part):
+                        fetched[b][key] = part
+            for b, block in fetched.items():
+                blocks[b] = block
+                if b + span <= complete_before:
+                    to_store[self._key(query, step, b)] = block
+
+        await self.store.set_many(to_store)
+
+        # Stitch the blocks back together per series, clipped to the request
+        merged: Dict[str, SeriesColumns] = {}
+        for b in block_starts:
+            for key, series in blocks[b].items():
+                part = series.slice_time(start, math.nextafter(end, math.inf))
+                if not len(part):
+                    continue
+                if key in merged:
+                    merged[key].extend(part)
+                else:
+                    merged[key] = part
+
+        return list(merged.values())
@@ -0,0 +1,149 @@
+import math
+import time
+from array import array
+from typing import Any, Dict, Optional, Tuple
+from ..core import settings
+from .series import iso_to_unix, little_endian_bytes
+
+
+class SampleRing:
+    """
+    Fixed-size ring of polled snapshots for one server.
+
+    Timestamps and each metric are float64 arrays allocated once at full
+    capacity (NaN for missing values); the oldest sample is overwritten
+    when the ring is full.
+    """
+
+    __slots__ = ("capacity", "timestamps", "values", "_next", "_size")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array("d", [math.nan]) * capacity
+        self.values: Dict[str, array] = {}
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def newest(self) -> float:
+        return self.timestamps[self._next - 1] if self._size else -math.inf
+
+    def append(self, timestamp: float, metrics: Dict[str, Optional[float]]) -> None:
+        # Snapshots relayed twice (or out of order) would break the time axis
+        if timestamp <= self.newest:
+            return
+        index = self._next
+        self.timestamps[index] = timestamp
+        for name in metrics:
+            if name not in self.values:
+                self.values[name] = array("d", [math.nan]) * self.capacity
+        for name, column in self.values.items():
+            value = metrics.get(name)
+            column[index] = math.nan if value is None else value
+        self._next = (index + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def window(self, since: float = -math.inf) -> Tuple[array, Dict[str, array]]:
+        """
+        Return the samples newer than `since` in chronological order.
+        """
+        start = (self._next - self._size) % self.capacity
+        order = [(start + offset) % self.capacity for offset in range(self._size)]
+        order = [index for index in order if self.timestamps[index] > since]
+        timestamps = array("d", (self.timestamps[index] for index in order))
+        values = {
+            name: array("d", (column[index] for index in order))
+            for name, column in self.values.items()
+        }
+        return timestamps, values
+
+
+class RecentSamples:
+    """
+    Ring buffers of the last `window_seconds` of polled metrics per server,
+    fed by the metrics hub. They back the WebSocket backfill frame and the
+    recent-metrics endpoint without a Prometheus query.
+
+    Rings of servers that are no longer polled or relayed are dropped once
+    their newest sample falls out of the window (checked at most once per
+    interval), so memory follows the servers currently being watched.
+    """
+
+    def __init__(self, window_seconds: float, interval: float):
+        self.window_seconds = window_seconds
+        self.interval = interval
+        self.capacity = max(1, math.ceil(window_seconds / interval))
+        self._rings: Dict[int, SampleRing] = {}
+        self._pruned_at = -math.inf
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def record(self, snapshot: Dict[str, Any]) -> None:
+        timestamp = iso_to_unix(snapshot.get("timestamp"))
+        if timestamp is None:
+            return
+        ring = self._rings.get(snapshot["server_id"])
+        if ring is None:
+            ring = self._rings[snapshot["server_id"]] = SampleRing(self.capacity)
+        ring.append(timestamp, snapshot.get("metrics", {}))
+        self._maybe_prune()
+
+    def prune(self, now: Optional[float] = None) -> None:
+        """
+        Drop the rings whose newest sample is older than the window.
+        """
+        now = time.time() if now is None else now
+        self._pruned_at = now
+        cutoff = now - self.window_seconds
+        for server_id in [server_id for server_id, ring in self._rings.items() if ring.newest <= cutoff]:
+            del self._rings[server_id]
+
+    def get(
+        self,
+        server_id: int,
+        since: Optional[float] = None,
+        binary: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Return a server's samples newer than `since` (default: the last
+        window_seconds) as shared timestamps plus one column per metric.
+        Missing values are None, or NaN in little-endian float64 bytes when
+        binary is set.
+        """
+        self._maybe_prune()
+        if since is None:
+            since = time.time() - self.window_seconds
+        ring = self._rings.get(server_id)
+        if ring is None:
+            timestamps, values = array("d"), {}
+        else:
+            timestamps, values = ring.window(since)
+        if binary:
+            return {
+                "server_id": server_id,
+                "timestamps": little_endian_bytes(timestamps),
+                "metrics": {name: little_endian_bytes(column) for name, column in values.items()},
+            }
+        return {
+            "server_id": server_id,
+            "timestamps": list(timestamps),
+            "metrics": {
+                name: [value if math.isfinite(value) else None for value in column]
+                for name, column in values.items()
+            },
+        }
+
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        if now - self._pruned_at >= self.interval:
+            self.prune(now)
+
+
+recent_samples = RecentSamples(
+    window_seconds=settings.WS_BACKFILL_SECONDS,
+    interval=settings.WS_METRICS_INTERVAL_SECONDS,
+)
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque
+from prometheus_client import Gauge
+
+prometheus_concurrency_limit = Gauge(
+    "vigil_prometheus_concurrency_limit",
+    "Current adaptive limit on concurrent Prometheus requests.",
+)
+prometheus_inflight_requests = Gauge(
+    "vigil_prometheus_inflight_requests",
+    "Prometheus requests currently in flight.",
+)
+prometheus_circuit_state = Gauge(
+    "vigil_prometheus_circuit_state",
+    "Prometheus circuit breaker state (0 = closed, 1 = half-open, 2 = open).",
+)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_OPEN = "open"
+CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter driven by observed latency.
+
+    Each request that completes within the latency target raises the limit
+    by 1/limit (about +1 per limit's worth of requests); a slow or failed
+    request multiplies it by the backoff factor.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        backoff: float = 0.9,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.inflight = 0
+        # Plain futures rather than asyncio primitives, which are bound to the
+        # first event loop that uses them
+        self._waiters: Deque[asyncio.Future] = deque()
+        prometheus_concurrency_limit.set(self.limit)
+
+    async def acquire(self) -> None:
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        if self.inflight < int(self.limit) and not self._waiters:
+            self._take()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self.inflight -= 1
+                self._wake()
+            raise
+
+    def release(self, latency: float, ok: bool) -> None:
+        self.inflight -= 1
+        prometheus_inflight_requests.set(self.inflight)
+        if ok and latency <= self.latency_target:
+            self.limit = min(self.limit + 1.0 / self.limit, float(self.max_limit))
+        else:
+            self.limit = max(self.limit * self.backoff, float(self.min_limit))
+        prometheus_concurrency_limit.set(self.limit)
+        self._wake()
+
+    def _take(self) -> None:
+        self.inflight += 1
+        prometheus_inflight_requests.set(self.inflight)
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._take()
+            waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Opens after a run of consecutive failures and rejects calls until
+    reset_timeout has passed, then lets a single trial call through
+    (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = CIRCUIT_CLOSED
+        self._trial_in_flight = False
+        prometheus_circuit_state.set(CIRCUIT_STATE_VALUES[self.state])
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now.
+        """
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(CIRCUIT_HALF_OPEN)
+        if self.state == CIRCUIT_HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_in_flight = False
+        if self.state != CIRCUIT_CLOSED:
+            self._set_state(CIRCUIT_CLOSED)
+
+    def record_aborted(self) -> None:
+        """
+        Record a call that was abandoned (e.g. cancelled) without an outcome.
+        """
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(CIRCUIT_OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        prometheus_circuit_state.set(CIRCUIT_STATE_VALUES[state])
@@ -0,0 +1,127 @@
+import codecs
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# Start of the data.result array in a Prometheus API response. Prometheus writes
+# "status" and "resultType" before "result", and no label data precedes it.
+RESULT_START = re.compile(r'"result"\s*:\s*\[')
+WHITESPACE = " \t\n\r"
+
+
+class ResponseParseError(ValueError):
+    """
+    Raised when a streamed Prometheus response is truncated or malformed.
+    """
+
+
+class ResultStreamParser:
+    """
+    Incremental parser for Prometheus query responses.
+
+    Bytes are fed as they arrive; every complete element of data.result is
+    decoded and returned as soon as it is available, so only one series needs
+    to be held in memory at a time. Everything outside the result array
+    (status, resultType, warnings) is kept and parsed into `envelope` on finish().
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pending: List[str] = []
+        self._pending_size = 0
+        self._state = "prefix"  # prefix -> result -> suffix
+        self._prefix = ""
+        self._suffix = ""
+        self._retry_size = 0
+        self.envelope: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        Consume a chunk of the body and return the result elements it completed.
+        """
+        text = self._decoder.decode(chunk)
+        if self._state == "suffix":
+            self._suffix += text
+            return []
+        # Hold chunks aside while an incomplete element can't be retried yet,
+        # instead of growing the buffer string on every chunk
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if len(self._buffer) + self._pending_size < self._retry_size:
+            return []
+        self._flush_pending()
+        return self._drain(final=False)
+
+    def _flush_pending(self) -> None:
+        self._buffer += "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+
+    def finish(self) -> List[Any]:
+        """
+        Signal the end of the body, returning any remaining elements.
+        """
+        self._pending.append(self._decoder.decode(b"", final=True))
+        if self._state == "suffix":
+            self._suffix += "".join(self._pending)
+            self._pending = []
+        else:
+            self._flush_pending()
+        items = self._drain(final=True)
+        if self._state == "prefix":
+            # No result array, e.g. an error envelope: parse it as a whole
+            document = self._buffer
+        elif self._state == "suffix":
+            document = self._prefix + "[]" + self._suffix
+        else:
+            raise ResponseParseError("Truncated Prometheus response")
+        try:
+            self.envelope = json.loads(document)
+        except ValueError as e:
+            raise ResponseParseError(f"Invalid Prometheus response: {e}")
+        return items
+
+    def _drain(self, final: bool) -> List[Any]:
+        items: List[Any] = []
+
+        if self._state == "prefix":
+            match = RESULT_START.search(self._buffer)
+            if match is None:
+                return items
+            self._prefix = self._buffer[:match.end() - 1]
+            self._buffer = self._buffer[match.end():]
+            self._state = "result"
+
+        pos = 0
+        buffer = self._buffer
+        while self._state == "result":
+            while pos < len(buffer) and (buffer[pos] in WHITESPACE or buffer[pos] == ","):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                self._state = "suffix"
+                self._suffix = buffer[pos + 1:]
+                pos = len(buffer)
+                break
+            # Re-trying an incomplete element only after the buffer has doubled
+            # keeps parsing of very large series linear overall
+            available = len(buffer) - pos
+            try:
+                item, end = self._json.raw_decode(buffer, pos)
+                # A bare number at the end of the buffer may continue in the next chunk
+                if not final and end == len(buffer) and not isinstance(item, (dict, list)):
+                    raise ValueError("Incomplete element")
+            except ValueError:
+                if final:
+                    raise ResponseParseError("Truncated Prometheus response")
+                self._retry_size = available * 2
+                break
+            items.append(item)
+            self._retry_size = 0
+            pos = end
+
+        self._buffer = buffer[pos:]
+        return items
@@ -0,0 +1,144 @@
+import math
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import msgpack
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+class SeriesColumns:
+    """
+    One range-query series stored column-wise: float64 arrays of timestamps
+    and values (NaN for missing samples) plus its labels.
+
+    Uses 16 bytes per sample instead of a [float, "string"] pair of Python objects.
+    """
+
+    __slots__ = ("labels", "timestamps", "values")
+
+    def __init__(self, labels: Dict[str, str]):
+        self.labels = labels
+        self.timestamps = array("d")
+        self.values = array("d")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SeriesColumns):
+            return NotImplemented
+        return (self.labels, self.timestamps, self.values) == (other.labels, other.timestamps, other.values)
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.timestamps) + len(self.values)) * self.timestamps.itemsize
+
+    @classmethod
+    def from_samples(cls, labels: Dict[str, str], samples: Iterable[List[Any]]) -> "SeriesColumns":
+        """
+        Build from Prometheus [timestamp, "value"] pairs.
+        """
+        series = cls(labels)
+        for ts, value in samples:
+            series.timestamps.append(float(ts))
+            series.values.append(float(value))
+        return series
+
+    @classmethod
+    def from_msgpack_dict(cls, data: Dict[str, Any]) -> "SeriesColumns":
+        """
+        Inverse of to_msgpack_dict().
+        """
+        series = cls(data["labels"])
+        series.timestamps = float64_array(data["timestamps"])
+        series.values = float64_array(data["values"])
+        return series
+
+    def extend(self, other: "SeriesColumns") -> None:
+        """
+        Append another part of the same series, e.g. the next shard of a range query.
+        """
+        self.timestamps.extend(other.timestamps)
+        self.values.extend(other.values)
+
+    def slice_time(self, start: float, stop: float) -> "SeriesColumns":
+        """
+        Return the samples with start <= timestamp < stop as a new series;
+        timestamps must be sorted.
+        """
+        first = bisect_left(self.timestamps, start)
+        last = bisect_left(self.timestamps, stop, first)
+        series = SeriesColumns(self.labels)
+        series.timestamps = self.timestamps[first:last]
+        series.values = self.values[first:last]
+        return series
+
+    def to_pairs(self) -> List[Tuple[float, Optional[float]]]:
+        """
+        Return [timestamp, value] pairs, with NaN and Inf mapped to None.
+        """
+        return [
+            (ts, value if math.isfinite(value) else None)
+            for ts, value in zip(self.timestamps, self.values)
+        ]
+
+    def to_msgpack_dict(self) -> Dict[str, Any]:
+        """
+        Return the series with timestamps and values as little-endian float64 bytes.
+        """
+        return {
+            "labels": self.labels,
+            "timestamps": little_endian_bytes(self.timestamps),
+            "values": little_endian_bytes(self.values),
+        }
+
+
+def little_endian_bytes(values: array) -> bytes:
+    """
+    Serialize a float64 array in little-endian byte order.
+    """
+    if sys.byteorder == "little":
+        return values.tobytes()
+    swapped = array("d", values)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def float64_array(data: bytes) -> array:
+    """
+    Deserialize little-endian float64 bytes (see little_endian_bytes).
+    """
+    values = array("d")
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def iso_to_unix(timestamp: Optional[str]) -> Optional[float]:
+    """
+    Convert a naive UTC ISO timestamp (as used in metric snapshots) to unix seconds.
+    """
+    if timestamp is None:
+        return None
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """
+    Whether an Accept header opts in to the msgpack format.
+    """
+    if not accept:
+        return False
+    media_types = [part.split(";")[0].strip() for part in accept.split(",")]
+    return MSGPACK_MEDIA_TYPE in media_types or "application/msgpack" in media_types
+
+
+def pack(payload: Dict[str, Any]) -> bytes:
+    """
+    Serialize a payload to msgpack.
+    """
+    return msgpack.packb(payload, use_bin_type=True)
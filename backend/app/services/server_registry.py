@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from ..core import settings
+from ..db.session import SessionLocal
+from ..models import Server
+
+
+class ServerInfo(NamedTuple):
+    """
+    Detached copy of the server fields needed to stream its metrics.
+    """
+
+    id: int
+    name: str
+    job_name: str
+    instance: str
+    is_active: bool
+
+
+class ServerRegistry:
+    """
+    In-memory cache of server metadata for long-lived streams.
+
+    Lookups use a short-lived session in a worker thread, so no pooled
+    connection is held while a socket is open. Entries (including misses)
+    expire after ttl seconds; the servers API invalidates them on update and
+    delete so changes in this process apply on the next poll.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, Optional[ServerInfo]]] = {}
+
+    async def get(self, server_id: int) -> Optional[ServerInfo]:
+        return (await self.get_many([server_id])).get(server_id)
+
+    async def get_many(self, server_ids: Iterable[int]) -> Dict[int, ServerInfo]:
+        """
+        Return the known servers among server_ids, loading missing or expired
+        entries in a single query.
+        """
+        now = time.monotonic()
+        found: Dict[int, ServerInfo] = {}
+        missing = []
+        for server_id in set(server_ids):
+            entry = self._entries.get(server_id)
+            if entry is None or entry[0] <= now:
+                missing.append(server_id)
+            elif entry[1] is not None:
+                found[server_id] = entry[1]
+
+        if missing:
+            loaded = {server.id: server for server in await asyncio.to_thread(self._load, missing)}
+            expires_at = time.monotonic() + self.ttl
+            for server_id in missing:
+                self._entries[server_id] = (expires_at, loaded.get(server_id))
+            found.update(loaded)
+        return found
+
+    def invalidate(self, server_id: Optional[int] = None) -> None:
+        """
+        Forget one server, or every server when no ID is given.
+        """
+        if server_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(server_id, None)
+
+    def _load(self, server_ids: List[int]) -> List[ServerInfo]:
+        db = SessionLocal()
+        try:
+            servers = db.query(Server).filter(Server.id.in_(server_ids)).all()
+            return [
+                ServerInfo(server.id, server.name, server.job_name, server.instance, bool(server.is_active))
+                for server in servers
+            ]
+        finally:
+            db.close()
+
+
+server_registry = ServerRegistry(ttl=settings.WS_SERVER_REGISTRY_TTL_SECONDS)
@@ -1,8 +1,72 @@
+import asyncio
+import os
+import httpx
 import pytest
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi import status
+from prometheus_client import REGISTRY
+from redis.exceptions import WatchError
+from sqlalchemy import event
 from ..models import Server, AlertRule, AlertEvent
-from ..services.alert_service import compare_values, process_alert_rule
+from ..services.alert_scheduler import MemoryAlertSchedule, RedisAlertSchedule
+from ..services.alert_state import MemoryAlertStateStore
+from ..services.alert_service import (
+    check_alert_rules,
+    mark_alert_rules_changed,
+    compare_values,
+    evaluate_alert_rules,
+    evaluate_alert_shard,
+    ServerIndex,
+    query_series_values,
+    query_shard,
+    run_async,
+    shard_rules,
+    start_worker_metrics_server,
+)
+from ..services.prometheus_service import normalize_promql, prometheus_service
+
+
+def prometheus_results():
+    """
+    Mock for iter_query that streams the series of its return_value, a query
+    result (or None to fail the query).
+    """
+    mock = MagicMock()
+
+    def iter_query(query, timeout=None):
+        result = mock.return_value
+
+        async def stream():
+            if result is None:
+                raise RuntimeError("Prometheus is unavailable")
+            for series in result["result"]:
+                yield series
+
+        return stream()
+
+    mock.side_effect = iter_query
+    return mock
+
+
+@pytest.fixture(autouse=True)
+def alert_state_store():
+    """
+    Fresh in-memory alert state for each test.
+    """
+    store = MemoryAlertStateStore()
+    with patch("app.services.alert_service.alert_state_store", store):
+        yield store
+
+
+@pytest.fixture(autouse=True)
+def alert_schedule():
+    """
+    Fresh in-memory alert schedule without jitter for each test.
+    """
+    schedule = MemoryAlertSchedule(jitter=0.0)
+    with patch("app.services.alert_service.alert_schedule", schedule), \
+            patch("app.services.alert_service._schedule_synced", (None, 0.0)):
+        yield schedule
 
 
 @pytest.fixture
@@ -93,6 +157,28 @@ def test_create_alert_rule_invalid_comparison(client, auth_headers, test_server)
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
 
+def test_create_vector_alert_rule(client, auth_headers):
+    """
+    Test creating a vector rule, which needs no server, and rejecting a single rule without one.
+    """
+    rule_data = {
+        "name": "Fleet CPU Alert",
+        "metric_name": "cpu_usage",
+        "promql": 'avg by (job, instance) (rate(node_cpu_seconds_total{mode!="idle"}[5m])) * 100',
+        "threshold": 90.0,
+        "comparison": ">",
+        "evaluation_mode": "vector",
+    }
+    response = client.post("/api/v1/alerts/rules/", json=rule_data, headers=auth_headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["server_id"] is None
+    assert response.json()["evaluation_mode"] == "vector"
+
+    rule_data["evaluation_mode"] = "single"
+    response = client.post("/api/v1/alerts/rules/", json=rule_data, headers=auth_headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 def test_create_alert_rule_nonexistent_server(client, auth_headers):
     """
     Test creating alert rule for non-existent server.
@@ -214,9 +300,9 @@ def test_compare_values():
 
 
 @pytest.mark.asyncio
-@patch("app.services.alert_service.prometheus_service.query")
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
 @patch("app.services.alert_service.telegram_service.send_alert")
-async def test_process_alert_rule_triggered(
+async def test_evaluate_alert_rule_triggered(
     mock_telegram,
     mock_prometheus,
     db_session,
@@ -232,7 +318,7 @@ async def test_process_alert_rule_triggered(
     }
     mock_telegram.return_value = True
 
-    await process_alert_rule(db_session, test_alert_rule)
+    await evaluate_alert_rules(db_session, [test_alert_rule])
 
     # Check that an alert event was created
     event = db_session.query(AlertEvent).filter(
@@ -244,8 +330,8 @@ async def test_process_alert_rule_triggered(
 
 
 @pytest.mark.asyncio
-@patch("app.services.alert_service.prometheus_service.query")
-async def test_process_alert_rule_not_triggered(
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+async def test_evaluate_alert_rule_not_triggered(
     mock_prometheus,
     db_session,
     test_alert_rule,
@@ -259,10 +345,862 @@ async def test_process_alert_rule_not_triggered(
         "result": [{"value": [0, "50.0"]}]
     }
 
-    await process_alert_rule(db_session, test_alert_rule)
+    await evaluate_alert_rules(db_session, [test_alert_rule])
 
     # Check that no alert event was created
     event = db_session.query(AlertEvent).filter(
         AlertEvent.alert_rule_id == test_alert_rule.id
     ).first()
     assert event is None
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+async def test_evaluate_alert_rules_concurrently(mock_prometheus, db_session, test_server):
+    """
+    Test that distinct queries run concurrently within the bound.
+    """
+    running = 0
+    peak = 0
+
+    async def iter_query(promql, timeout=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        yield {"value": [0, "1"]}
+
+    mock_prometheus.side_effect = iter_query
+    rules = [
+        AlertRule(
+            id=rule_id,
+            server_id=test_server.id,
+            promql=f"metric_{rule_id}",
+            threshold=80.0,
+            comparison=">",
+            repeat_interval_sec=300,
+        )
+        for rule_id in range(20)
+    ]
+
+    with patch("app.services.alert_service.settings.ALERT_EVAL_CONCURRENCY", 5):
+        stats = await evaluate_alert_rules(db_session, rules)
+
+    assert peak == 5
+    assert stats["rules"] == 20
+    assert stats["queries"] == 20
+    assert stats["failed"] == 0
+    assert stats["duration_seconds"] < 20 * 0.05
+    assert stats["rules_per_second"] > 0
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_shares_queries(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that rules with the same PromQL are evaluated against a single query.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    mock_telegram.return_value = True
+    rules = []
+    for name, promql, threshold in [
+        ("CPU warning", 'avg(rate(node_cpu_seconds_total{mode!="idle"}[5m])) * 100', 70.0),
+        ("CPU critical", 'avg( rate(node_cpu_seconds_total{ mode!="idle" }[5m]) )  * 100', 90.0),
+        ("Memory", "node_memory_usage_percent", 80.0),
+    ]:
+        rule = AlertRule(
+            name=name,
+            server_id=test_server.id,
+            metric_name="cpu_usage",
+            promql=promql,
+            threshold=threshold,
+            comparison=">",
+        )
+        db_session.add(rule)
+        rules.append(rule)
+    db_session.commit()
+
+    stats = await evaluate_alert_rules(db_session, rules)
+
+    assert mock_prometheus.call_count == 2
+    assert stats["rules"] == 3
+    assert stats["queries"] == 2
+    triggered = {event.alert_rule_id for event in db_session.query(AlertEvent).all()}
+    assert triggered == {rules[0].id, rules[2].id}
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_sends_original_promql(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that grouped rules send their expression as written, keeping comments on their own lines.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "12"]}]}
+    mock_telegram.return_value = True
+    rules = make_rules(db_session, test_server, 2)
+    rules[0].promql = "rate(x[5m]) # per-second rate\n  > 10"
+    rules[1].promql = "rate(x[5m]) > 10"
+    db_session.commit()
+
+    stats = await evaluate_alert_rules(db_session, rules)
+
+    assert stats["queries"] == 1
+    assert mock_prometheus.call_args.args[0] in {rule.promql for rule in rules}
+    assert normalize_promql("rate(x[5m])  # per-second rate > 10") == "rate(x[5m])"
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_vector_alert_rule(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that a vector rule creates one event per matching server from a single query.
+    """
+    other = Server(name="Other Server", job_name="node", instance="other:9100", is_active=True)
+    db_session.add(other)
+    rule = AlertRule(
+        name="Fleet CPU Alert",
+        metric_name="cpu_usage",
+        promql='avg by (job, instance) (rate(node_cpu_seconds_total{mode!="idle"}[5m])) * 100',
+        threshold=80.0,
+        comparison=">",
+        repeat_interval_sec=300,
+        evaluation_mode="vector",
+    )
+    db_session.add(rule)
+    db_session.commit()
+
+    mock_prometheus.return_value = {
+        "result": [
+            {"metric": {"job": "node", "instance": "localhost:9100"}, "value": [0, "85.5"]},
+            {"metric": {"job": "node", "instance": "other:9100"}, "value": [0, "95.0"]},
+            {"metric": {"job": "node", "instance": "unknown:9100"}, "value": [0, "99.0"]},
+            {"metric": {"job": "node", "instance": "idle:9100"}, "value": [0, "10.0"]},
+        ]
+    }
+    mock_telegram.return_value = True
+
+    await evaluate_alert_rules(db_session, [rule])
+
+    assert mock_prometheus.call_count == 1
+    events = db_session.query(AlertEvent).filter(AlertEvent.alert_rule_id == rule.id).all()
+    assert {(event.server_id, event.value) for event in events} == {(test_server.id, 85.5), (other.id, 95.0)}
+    assert mock_telegram.await_count == 2
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+async def test_evaluate_alert_rule_uses_own_series(
+    mock_prometheus,
+    db_session,
+    test_alert_rule,
+    test_server
+):
+    """
+    Test that a single-server rule reads its own server's series, not just the first one.
+    """
+    mock_prometheus.return_value = {
+        "result": [
+            {"metric": {"job": "node", "instance": "other:9100"}, "value": [0, "10.0"]},
+            {"metric": {"job": "node", "instance": "localhost:9100"}, "value": [0, "85.5"]},
+        ]
+    }
+
+    with patch("app.services.alert_service.telegram_service.send_alert", new_callable=AsyncMock):
+        await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    event = db_session.query(AlertEvent).filter(
+        AlertEvent.alert_rule_id == test_alert_rule.id
+    ).first()
+    assert event is not None
+    assert event.value == 85.5
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_ignores_other_servers_series(
+    mock_telegram,
+    mock_prometheus,
+    db_session,
+    test_alert_rule
+):
+    """
+    Test that a single-server rule does not fire on a result that only holds other known servers' series.
+    """
+    db_session.add(Server(name="Other Server", job_name="node", instance="other:9100", is_active=True))
+    db_session.commit()
+    mock_prometheus.return_value = {
+        "result": [
+            {"metric": {"job": "node", "instance": "other:9100"}, "value": [0, "99.0"]},
+            {"metric": {"instance": "other:9100"}, "value": [0, "98.0"]},
+        ]
+    }
+
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    assert db_session.query(AlertEvent).count() == 0
+    mock_telegram.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("labels", [
+    # avg by (instance): no job label
+    {"instance": "localhost:9100"},
+    # Another exporter scraping the same target
+    {"job": "process", "instance": "localhost:9100"},
+    # Another exporter's own target, e.g. a blackbox probe
+    {"job": "blackbox", "instance": "https://example.com"},
+])
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_matches_single_rule_series(
+    mock_telegram,
+    mock_prometheus,
+    labels,
+    db_session,
+    test_alert_rule
+):
+    """
+    Test that a single-server rule fires on series not labelled with its exact job/instance target.
+    """
+    db_session.add(Server(name="Other Server", job_name="node", instance="other:9100", is_active=True))
+    db_session.commit()
+    mock_prometheus.return_value = {
+        "result": [
+            {"metric": {"instance": "other:9100"}, "value": [0, "10.0"]},
+            {"metric": labels, "value": [0, "95.0"]},
+        ]
+    }
+    mock_telegram.return_value = True
+
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    event = db_session.query(AlertEvent).filter(AlertEvent.alert_rule_id == test_alert_rule.id).one()
+    assert event.value == 95.0
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_constant_queries(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that the number of SELECTs per cycle does not grow with the number of rules.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    mock_telegram.return_value = True
+    # As in check_alert_rules, loaded objects stay usable after commits
+    db_session.expire_on_commit = False
+
+    async def selects_per_cycle(rule_count):
+        rules = [
+            AlertRule(
+                name=f"Rule {index}",
+                server_id=test_server.id,
+                metric_name="cpu_usage",
+                promql=f"metric_{rule_count}_{index}",
+                threshold=80.0,
+                comparison=">",
+                repeat_interval_sec=300,
+            )
+            for index in range(rule_count)
+        ]
+        db_session.add_all(rules)
+        db_session.commit()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db_session.get_bind(), "before_cursor_execute", record)
+        try:
+            await evaluate_alert_rules(db_session, rules)
+            # A second cycle finds the alerts firing and triggers nothing
+            await evaluate_alert_rules(db_session, rules)
+        finally:
+            event.remove(db_session.get_bind(), "before_cursor_execute", record)
+        return len([statement for statement in statements if statement.lstrip().upper().startswith("SELECT")])
+
+    assert await selects_per_cycle(2) == await selects_per_cycle(20)
+    assert db_session.query(AlertEvent).count() == 22
+
+
+def make_rules(db_session, server, count):
+    rules = [
+        AlertRule(
+            name=f"Rule {index}",
+            server_id=server.id,
+            metric_name="cpu_usage",
+            promql="node_cpu_usage_percent",
+            threshold=80.0 + index,
+            comparison=">",
+            repeat_interval_sec=300,
+        )
+        for index in range(count)
+    ]
+    db_session.add_all(rules)
+    db_session.commit()
+    return rules
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_batches_events(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that a cycle's events are written in chunked bulk inserts before notifying.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "99.0"]}]}
+    rules = make_rules(db_session, test_server, 5)
+    notified_after_commit = []
+    mock_telegram.side_effect = lambda **kwargs: notified_after_commit.append(
+        db_session.query(AlertEvent).count() == 5
+    )
+
+    with patch("app.services.alert_service.settings.ALERT_EVENT_BATCH_SIZE", 2), \
+            patch.object(db_session, "commit", wraps=db_session.commit) as mock_commit:
+        stats = await evaluate_alert_rules(db_session, rules)
+
+    assert mock_commit.call_count == 3
+    assert stats["events"] == 5
+    assert db_session.query(AlertEvent).count() == 5
+    assert notified_after_commit == [True] * 5
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_evaluate_alert_rules_skips_notifications_when_save_fails(
+    mock_telegram,
+    mock_prometheus,
+    db_session,
+    test_server
+):
+    """
+    Test that no notification is sent for events that could not be stored.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "99.0"]}]}
+    rules = make_rules(db_session, test_server, 3)
+
+    execute = db_session.execute
+
+    def failing_insert(statement, *args, **kwargs):
+        if getattr(statement, "is_insert", False):
+            raise RuntimeError("database is down")
+        return execute(statement, *args, **kwargs)
+
+    with patch.object(db_session, "execute", side_effect=failing_insert):
+        stats = await evaluate_alert_rules(db_session, rules)
+
+    assert stats["events"] == 0
+    mock_telegram.assert_not_called()
+
+    # The alerts did not become firing, so the next cycle stores them
+    stats = await evaluate_alert_rules(db_session, rules)
+    assert stats["events"] == 3
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.time.time")
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_alert_rule_fires_after_for_duration(
+    mock_telegram,
+    mock_prometheus,
+    mock_time,
+    db_session,
+    test_alert_rule,
+    alert_state_store
+):
+    """
+    Test that an alert with for_duration_sec stays pending until the condition has held that long.
+    """
+    test_alert_rule.for_duration_sec = 120
+    db_session.commit()
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+
+    mock_time.return_value = 1000.0
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    states = await alert_state_store.load([test_alert_rule.id])
+    assert states[test_alert_rule.id][test_alert_rule.server_id]["state"] == "pending"
+    assert db_session.query(AlertEvent).count() == 0
+
+    mock_time.return_value = 1060.0
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    assert db_session.query(AlertEvent).count() == 0
+
+    mock_time.return_value = 1120.0
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    states = await alert_state_store.load([test_alert_rule.id])
+    assert states[test_alert_rule.id][test_alert_rule.server_id]["state"] == "firing"
+    assert db_session.query(AlertEvent).filter(AlertEvent.status == "triggered").count() == 1
+    mock_telegram.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_pending_alert_clears_without_event(
+    mock_telegram,
+    mock_prometheus,
+    db_session,
+    test_alert_rule,
+    alert_state_store
+):
+    """
+    Test that a pending alert whose condition clears is dropped silently.
+    """
+    test_alert_rule.for_duration_sec = 120
+    db_session.commit()
+
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    mock_prometheus.return_value = {"result": [{"value": [0, "50.0"]}]}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    assert await alert_state_store.load([test_alert_rule.id]) == {}
+    assert db_session.query(AlertEvent).count() == 0
+    mock_telegram.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_firing_alert_resolves(mock_telegram, mock_prometheus, db_session, test_alert_rule, alert_state_store):
+    """
+    Test that a firing alert resolves when its condition clears or its series disappears.
+    """
+    mock_telegram.return_value = True
+
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    mock_prometheus.return_value = {"result": [{"value": [0, "50.0"]}]}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    # A failed query keeps the alert firing, an empty result resolves it
+    mock_prometheus.return_value = None
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+    mock_prometheus.return_value = {"result": []}
+    await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    events = db_session.query(AlertEvent).order_by(AlertEvent.id).all()
+    assert [event.status for event in events] == ["triggered", "resolved", "triggered", "resolved"]
+    assert events[1].value == 50.0
+    assert events[3].value == 85.5
+    assert [call.kwargs["status"] for call in mock_telegram.call_args_list] == [
+        "triggered", "resolved", "triggered", "resolved"
+    ]
+    assert await alert_state_store.load([test_alert_rule.id]) == {}
+
+
+@pytest.mark.asyncio
+@patch("app.services.alert_service.time.time")
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+async def test_firing_alert_reminds_every_repeat_interval(
+    mock_telegram,
+    mock_prometheus,
+    mock_time,
+    db_session,
+    test_alert_rule
+):
+    """
+    Test that a firing alert is re-notified every repeat_interval_sec without new events.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "85.5"]}]}
+    mock_telegram.return_value = True
+
+    for now in (1000.0, 1100.0, 1300.0, 1400.0):
+        mock_time.return_value = now
+        await evaluate_alert_rules(db_session, [test_alert_rule])
+
+    assert mock_telegram.call_count == 2
+    assert db_session.query(AlertEvent).count() == 1
+
+
+def test_shard_rules():
+    """
+    Test that rules are split across shards by query, and mostly stay put when a shard is added.
+    """
+    rules = {rule_id: f"metric_{rule_id // 2}" for rule_id in range(1000)}
+    rules[1000] = "metric_0 # the same query as rules 0 and 1"
+    shards = shard_rules(rules, 4)
+
+    assert sorted(shards) == [0, 1, 2, 3]
+    assert sorted(rule_id for ids in shards.values() for rule_id in ids) == sorted(rules)
+    assert all(150 < len(ids) < 350 for ids in shards.values())
+    # Rules sharing a query land in the same shard
+    for ids in shards.values():
+        assert {0, 1, 1000} <= set(ids) or not {0, 1, 1000} & set(ids)
+        assert all(rule_id ^ 1 in ids for rule_id in ids if rule_id < 1000)
+
+    moved = [promql for promql in set(rules.values()) if query_shard(promql, 4) != query_shard(promql, 5)]
+    assert all(query_shard(promql, 5) == 4 for promql in moved)
+    assert len(moved) < 150
+
+
+@patch("app.services.alert_service.evaluate_alert_shard.apply_async")
+def test_check_alert_rules_dispatches_shards(mock_apply_async, db_session, test_server):
+    """
+    Test that the periodic task dispatches one task per shard of active rules to the alerts queue.
+    """
+    rules = make_rules(db_session, test_server, 10)
+    rules[0].is_active = False
+    db_session.commit()
+    active_ids = sorted(rule.id for rule in rules[1:])
+
+    with patch("app.services.alert_service.SessionLocal", return_value=db_session), \
+            patch("app.services.alert_service.settings.ALERT_SHARDS", 3):
+        result = check_alert_rules()
+
+    assert result == {"synced": True, "due": 9, "shards": mock_apply_async.call_count}
+    dispatched = []
+    for call in mock_apply_async.call_args_list:
+        shard, rule_ids = call.kwargs["args"]
+        assert 0 <= shard < 3
+        assert call.kwargs["queue"] == "alerts"
+        dispatched.extend(rule_ids)
+    assert sorted(dispatched) == active_ids
+
+
+@patch("app.services.alert_service.prometheus_service.iter_query", new_callable=prometheus_results)
+@patch("app.services.alert_service.telegram_service.send_alert")
+def test_evaluate_alert_shard(mock_telegram, mock_prometheus, db_session, test_server):
+    """
+    Test that a shard task evaluates only its own active rules.
+    """
+    mock_prometheus.return_value = {"result": [{"value": [0, "99.0"]}]}
+    mock_telegram.return_value = True
+    rules = make_rules(db_session, test_server, 3)
+    rules[1].is_active = False
+    db_session.commit()
+    rule_ids = [rules[0].id, rules[1].id]
+
+    with patch("app.services.alert_service.SessionLocal", return_value=db_session):
+        stats = evaluate_alert_shard(2, rule_ids)
+
+    assert stats["shard"] == 2
+    assert stats["rules"] == 1
+    assert stats["events"] == 1
+    assert db_session.query(AlertEvent).one().alert_rule_id == rule_ids[0]
+
+
+def redis_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeSortedSetRedis:
+    """
+    Just enough of redis.asyncio for the alert schedule, with WATCH
+    conflicts detected by counting writes.
+    """
+
+    def __init__(self):
+        self.scores = {}
+        self.hashes = {}
+        self.values = {}
+        self.writes = 0
+        # Awaited once before the next EXEC, to interleave another client
+        self.before_exec = None
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+    async def zrange(self, key, start, end, withscores=False):
+        return sorted(self.scores.items(), key=lambda item: item[1])
+
+    async def zrangebyscore(self, key, min, max, withscores=False):
+        scheduled = [(member, score) for member, score in sorted(self.scores.items(), key=lambda item: item[1]) if score <= max]
+        return scheduled if withscores else [member for member, _ in scheduled]
+
+    async def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(redis_bytes(field)) for field in fields]
+
+    def pipeline(self, transaction=True):
+        return FakeSortedSetPipeline(self)
+
+
+class FakeSortedSetPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watched = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.watched = None
+
+    async def watch(self, *keys):
+        self.watched = self.redis.writes
+
+    async def zrangebyscore(self, key, min, max, withscores=False):
+        return await self.redis.zrangebyscore(key, min, max, withscores=withscores)
+
+    async def hmget(self, key, fields):
+        return await self.redis.hmget(key, fields)
+
+    def multi(self):
+        pass
+
+    def delete(self, key):
+        self.commands.append(lambda: self.redis.hashes.pop(key, None))
+
+    def hset(self, key, mapping):
+        def hset():
+            self.redis.hashes.setdefault(key, {}).update(
+                {redis_bytes(field): redis_bytes(value) for field, value in mapping.items()}
+            )
+        self.commands.append(hset)
+
+    def zrem(self, key, *members):
+        def zrem():
+            for member in members:
+                self.redis.scores.pop(redis_bytes(member), None)
+        self.commands.append(zrem)
+
+    def zadd(self, key, mapping, nx=False, lt=False):
+        def zadd():
+            for member, score in mapping.items():
+                current = self.redis.scores.get(redis_bytes(member))
+                if current is None or not (nx or lt and score >= current):
+                    self.redis.scores[redis_bytes(member)] = score
+        self.commands.append(zadd)
+
+    async def execute(self):
+        if self.redis.before_exec:
+            before_exec, self.redis.before_exec = self.redis.before_exec, None
+            await before_exec()
+        commands, self.commands = self.commands, []
+        if self.watched is not None and self.watched != self.redis.writes:
+            self.watched = None
+            raise WatchError()
+        self.watched = None
+        for command in commands:
+            command()
+        self.redis.writes += 1
+        return []
+
+
+def make_schedule(schedule_class):
+    if schedule_class is RedisAlertSchedule:
+        return RedisAlertSchedule("redis://test", jitter=0.0)
+    return MemoryAlertSchedule(jitter=0.0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("schedule_class", [MemoryAlertSchedule, RedisAlertSchedule])
+async def test_alert_schedule_pops_due_rules(schedule_class):
+    """
+    Test that rules come due at their own intervals and follow rule changes.
+    """
+    schedule = make_schedule(schedule_class)
+    fake_redis = FakeSortedSetRedis()
+    with patch("app.services.alert_scheduler.redis.from_url", return_value=fake_redis):
+        await schedule.sync({1: 10, 2: 60}, 0)
+        assert await schedule.pop_due(0) == [1, 2]
+        assert await schedule.pop_due(5) == []
+        assert await schedule.pop_due(10) == [1]
+        assert await schedule.pop_due(20) == [1]
+
+        # Rule 2 gets a shorter interval and rule 1 is disabled
+        await schedule.sync({2: 15}, 25)
+        assert await schedule.pop_due(25) == []
+        assert await schedule.pop_due(40) == [2]
+        assert await schedule.pop_due(60) == [2]
+
+        assert await schedule.changes() == 0
+        await schedule.mark_changed()
+        assert await schedule.changes() == 1
+
+    if schedule_class is RedisAlertSchedule:
+        assert set(fake_redis.scores) == {b"2"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("schedule_class", [MemoryAlertSchedule, RedisAlertSchedule])
+async def test_alert_schedule_does_not_drift_with_tick_lag(schedule_class):
+    """
+    Test that rules are rescheduled from their previous due time, not from the tick that popped them.
+    """
+    schedule = make_schedule(schedule_class)
+    with patch("app.services.alert_scheduler.redis.from_url", return_value=FakeSortedSetRedis()):
+        await schedule.sync({1: 15}, 0)
+        # Ticks land 4s apart, so most runs are popped a little late
+        popped = [now for now in range(0, 95, 4) if await schedule.pop_due(now)]
+        assert popped == [0, 16, 32, 48, 60, 76, 92]
+
+        # A rule that fell behind runs once more right away, then keeps its interval again
+        assert await schedule.pop_due(200) == [1]
+        assert await schedule.pop_due(205) == [1]
+        assert await schedule.pop_due(210) == []
+        assert await schedule.pop_due(220) == [1]
+
+
+@pytest.mark.asyncio
+async def test_redis_alert_schedule_overlapping_pops():
+    """
+    Test that two overlapping ticks never both dispatch the same due rules.
+    """
+    fake_redis = FakeSortedSetRedis()
+    first, second = make_schedule(RedisAlertSchedule), make_schedule(RedisAlertSchedule)
+    popped = []
+
+    async def other_tick():
+        popped.append(await second.pop_due(0))
+
+    with patch("app.services.alert_scheduler.redis.from_url", return_value=fake_redis):
+        await first.sync({1: 10, 2: 10}, 0)
+        # The second tick claims the rules between the first one's read and EXEC
+        fake_redis.before_exec = other_tick
+        popped.append(await first.pop_due(0))
+
+    assert popped == [[1, 2], []]
+    assert fake_redis.scores == {b"1": 10, b"2": 10}
+
+
+@patch("app.services.alert_service.time.time")
+@patch("app.services.alert_service.evaluate_alert_shard.apply_async")
+def test_check_alert_rules_dispatches_due_rules(mock_apply_async, mock_time, db_session, test_server):
+    """
+    Test that each tick dispatches only the rules whose evaluation interval has elapsed.
+    """
+    rules = make_rules(db_session, test_server, 2)
+    rules[0].eval_interval_sec = 15
+    db_session.commit()
+    fast_id = rules[0].id
+
+    def tick(now):
+        mock_time.return_value = now
+        mock_apply_async.reset_mock()
+        with patch("app.services.alert_service.SessionLocal", return_value=db_session):
+            result = check_alert_rules()
+        return result["due"], [rule_id for call in mock_apply_async.call_args_list for rule_id in call.kwargs["args"][1]]
+
+    assert tick(1000.0)[0] == 2
+    assert tick(1005.0) == (0, [])
+    assert tick(1015.0) == (1, [fast_id])
+    assert tick(1030.0) == (1, [fast_id])
+    assert tick(1045.0) == (1, [fast_id])
+    assert mock_apply_async.call_args.kwargs["expires"] == 15
+    assert tick(1060.0)[0] == 2
+
+
+@patch("app.services.alert_service.time.time")
+@patch("app.services.alert_service.evaluate_alert_shard.apply_async")
+def test_check_alert_rules_syncs_on_rule_changes(mock_apply_async, mock_time, db_session, test_server):
+    """
+    Test that the schedule is only resynced with the rules table when rules change or it is due a resync.
+    """
+    fast_id, slow_id = [rule.id for rule in make_rules(db_session, test_server, 2)]
+
+    def update_slow_rule(**values):
+        # Ticks close the session, detaching the loaded rules
+        db_session.query(AlertRule).filter(AlertRule.id == slow_id).update(values)
+        db_session.commit()
+
+    def tick(now):
+        mock_time.return_value = now
+        mock_apply_async.reset_mock()
+        with patch("app.services.alert_service.SessionLocal", return_value=db_session):
+            result = check_alert_rules()
+        return result["synced"], [rule_id for call in mock_apply_async.call_args_list for rule_id in call.kwargs["args"][1]]
+
+    assert tick(1000.0)[0] is True
+    assert tick(1005.0) == (False, [])
+
+    # Unannounced changes wait for the periodic resync
+    update_slow_rule(eval_interval_sec=10)
+    assert tick(1010.0) == (False, [])
+
+    run_async(mark_alert_rules_changed())
+    assert tick(1015.0) == (True, [])
+    assert tick(1025.0) == (False, [slow_id])
+
+    # Disabled rules still in the schedule are not dispatched
+    update_slow_rule(is_active=False)
+    assert tick(1035.0) == (False, [])
+    assert tick(1320.0) == (True, [fast_id])
+
+
+def test_create_alert_rule_invalid_eval_interval(client, auth_headers, test_server):
+    """
+    Test creating an alert rule with a non-positive evaluation interval.
+    """
+    response = client.post(
+        "/api/v1/alerts/rules/",
+        headers=auth_headers,
+        json={
+            "name": "Fast Alert",
+            "server_id": test_server.id,
+            "metric_name": "cpu_usage",
+            "promql": "node_cpu_usage_percent",
+            "threshold": 80.0,
+            "comparison": ">",
+            "eval_interval_sec": 0,
+        },
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_query_series_values_streams_response(db_session, test_server):
+    """
+    Test that alert queries reduce the streamed Prometheus response to values per server.
+    """
+    other = {"job": "node", "instance": "other:9100"}
+    body = {
+        "status": "success",
+        "data": {
+            "resultType": "vector",
+            "result": [
+                {"metric": other, "value": [0, "12"]},
+                {"metric": {"job": test_server.job_name, "instance": test_server.instance}, "value": [0, "85.5"]},
+            ],
+        },
+    }
+
+    def create_client():
+        return httpx.AsyncClient(
+            base_url="http://prometheus:9090",
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, json=body)),
+        )
+
+    with patch.object(prometheus_service, "_create_client", side_effect=create_client):
+        values = await query_series_values("node_cpu_usage_percent", ServerIndex([test_server]))
+        await prometheus_service.close()
+
+    assert values.by_server == {test_server.id: 85.5}
+    assert values.by_instance == {test_server.instance: 85.5}
+    assert values.first == 12.0
+
+
+def test_worker_metrics_server_aggregates_pool_processes(tmp_path):
+    """
+    Test that workers serve their collectors, aggregated across prefork processes in multiprocess mode.
+    """
+    with patch("app.services.alert_service.start_http_server") as mock_start, \
+            patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}):
+        start_worker_metrics_server()
+
+    port = mock_start.call_args.args[0]
+    registry = mock_start.call_args.kwargs["registry"]
+    assert port == 9808
+    assert registry is not REGISTRY
+    assert registry.get_sample_value("vigil_alert_cycle_rules", {"shard": "0"}) is None
+
+    with patch("app.services.alert_service.start_http_server") as mock_start, \
+            patch("app.services.alert_service.settings.WORKER_METRICS_PORT", 0):
+        start_worker_metrics_server()
+    mock_start.assert_not_called()
@@ -1,7 +1,13 @@
+import msgpack
+import time
 import pytest
+from array import array
+from datetime import datetime
 from unittest.mock import patch, AsyncMock
 from fastapi import status
 from ..models import Server
+from ..services.recent_samples import RecentSamples
+from ..services.series import SeriesColumns
 
 
 @pytest.fixture
@@ -47,7 +53,7 @@ def test_get_server_metrics_summary(
     Test getting server metrics summary.
     """
     # Mock the Prometheus service response
-    mock_get_metrics.return_value = mock_prometheus_metrics
+    mock_get_metrics.return_value = (mock_prometheus_metrics, {})
 
     response = client.get(
         f"/api/v1/metrics/servers/{test_server.id}/summary",
@@ -129,7 +135,7 @@ def test_get_metrics_empty_response(
     Test getting metrics when Prometheus returns empty data.
     """
     # Mock empty metrics
-    mock_get_metrics.return_value = {}
+    mock_get_metrics.return_value = ({}, {})
 
     response = client.get(
         f"/api/v1/metrics/servers/{test_server.id}/summary",
@@ -138,3 +144,191 @@ def test_get_metrics_empty_response(
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert data["metrics"] == {}
+    assert data["errors"] == {}
+
+
+@patch("app.services.prometheus_service.prometheus_service.get_server_metrics")
+def test_get_metrics_partial_response(
+    mock_get_metrics,
+    client,
+    auth_headers,
+    test_server
+):
+    """
+    Test that metrics which timed out are reported alongside the ones that completed.
+    """
+    mock_get_metrics.return_value = (
+        {"cpu_usage_percent": 45.5},
+        {"disk_usage_percent": "timeout"},
+    )
+
+    response = client.get(
+        f"/api/v1/metrics/servers/{test_server.id}/summary",
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["metrics"] == {"cpu_usage_percent": 45.5}
+    assert data["errors"] == {"disk_usage_percent": "timeout"}
+
+
+@patch("app.services.prometheus_service.prometheus_service.get_fleet_metrics")
+def test_get_fleet_metrics_summary(
+    mock_get_fleet_metrics,
+    client,
+    auth_headers,
+    test_server,
+    db_session,
+    mock_prometheus_metrics
+):
+    """
+    Test getting metrics for the whole fleet in one call.
+    """
+    # An inactive server is excluded by default
+    inactive = Server(
+        name="Inactive Server",
+        job_name="node",
+        instance="inactive:9100",
+        is_active=False
+    )
+    db_session.add(inactive)
+    db_session.commit()
+
+    mock_get_fleet_metrics.return_value = (
+        {("node", "localhost:9100"): mock_prometheus_metrics},
+        {},
+    )
+
+    response = client.get("/api/v1/metrics/fleet/summary", headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["server_id"] == test_server.id
+    assert data[0]["metrics"]["cpu_usage_percent"] == 45.5
+    mock_get_fleet_metrics.assert_called_once()
+
+    response = client.get(
+        "/api/v1/metrics/fleet/summary",
+        params={"active_only": False, "server_ids": [inactive.id]},
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["server_id"] == inactive.id
+    assert data[0]["metrics"] == {}
+
+
+@patch("app.services.prometheus_service.prometheus_service.query_range")
+def test_get_server_metric_history(
+    mock_query_range,
+    client,
+    auth_headers,
+    test_server
+):
+    """
+    Test getting the history of a metric with an automatically chosen step.
+    """
+    mock_query_range.return_value = [
+        SeriesColumns.from_samples(
+            {"job": "node", "instance": "localhost:9100"},
+            [[1700000000, "12.5"], [1700003600, "NaN"]],
+        )
+    ]
+
+    response = client.get(
+        f"/api/v1/metrics/servers/{test_server.id}/history",
+        params={
+            "metric": "cpu_usage_percent",
+            "start": "2023-11-14T00:00:00Z",
+            "end": "2023-12-14T00:00:00Z",
+            "max_points": 100,
+        },
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["metric"] == "cpu_usage_percent"
+    assert (data["end"] - data["start"]) / data["step"] + 1 <= 100
+    assert data["series"][0]["values"] == [[1700000000, 12.5], [1700003600, None]]
+    assert mock_query_range.call_args.kwargs["step"] == f"{data['step']}s"
+
+
+def test_get_server_metric_history_invalid_metric(
+    client,
+    auth_headers,
+    test_server
+):
+    """
+    Test requesting history for an unknown metric.
+    """
+    response = client.get(
+        f"/api/v1/metrics/servers/{test_server.id}/history",
+        params={"metric": "unknown"},
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@patch("app.services.prometheus_service.prometheus_service.query_range")
+def test_get_server_metric_history_msgpack(
+    mock_query_range,
+    client,
+    auth_headers,
+    test_server
+):
+    """
+    Test the opt-in columnar msgpack format for metric history.
+    """
+    mock_query_range.return_value = [
+        SeriesColumns.from_samples(
+            {"job": "node", "instance": "localhost:9100"},
+            [[1700000000, "12.5"], [1700000060, "13.5"]],
+        )
+    ]
+
+    response = client.get(
+        f"/api/v1/metrics/servers/{test_server.id}/history",
+        params={"metric": "cpu_usage_percent"},
+        headers={**auth_headers, "Accept": "application/x-msgpack"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-msgpack"
+    data = msgpack.unpackb(response.content)
+    series = data["series"][0]
+    assert series["labels"]["instance"] == "localhost:9100"
+    assert list(array("d", series["timestamps"])) == [1700000000, 1700000060]
+    assert list(array("d", series["values"])) == [12.5, 13.5]
+
+
+def test_get_server_recent_metrics(client, auth_headers, test_server):
+    """
+    Test reading recently polled metrics without querying Prometheus.
+    """
+    samples = RecentSamples(window_seconds=60, interval=5)
+    now = int(time.time())
+    samples.record({
+        "server_id": test_server.id,
+        "timestamp": datetime.utcfromtimestamp(now - 10).isoformat(),
+        "metrics": {"cpu_usage_percent": 10.0, "memory_usage_percent": None},
+    })
+
+    with patch("app.api.v1.endpoints.metrics.recent_samples", samples):
+        response = client.get(
+            f"/api/v1/metrics/servers/{test_server.id}/recent",
+            headers=auth_headers
+        )
+        binary = client.get(
+            f"/api/v1/metrics/servers/{test_server.id}/recent",
+            headers={**auth_headers, "Accept": "application/x-msgpack"}
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "server_id": test_server.id,
+        "server_name": test_server.name,
+        "timestamps": [now - 10.0],
+        "metrics": {"cpu_usage_percent": [10.0], "memory_usage_percent": [None]},
+    }
+    payload = msgpack.unpackb(binary.content)
+    assert array("d", payload["metrics"]["cpu_usage_percent"]).tolist() == [10.0]
@@ -0,0 +1,402 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+from ..core import settings
+from ..services.prometheus_service import PrometheusService, compute_step
+from ..services.query_cache import QueryCache
+from ..services.range_cache import MemoryBlockStore, RangeCache
+from ..services.resilience import AdaptiveLimiter
+from ..services.response_stream import ResultStreamParser
+from ..services.series import SeriesColumns
+
+
+def make_client(handler):
+    """
+    Build an HTTP client that answers Prometheus requests with the given handler.
+    """
+    return httpx.AsyncClient(
+        base_url="http://prometheus:9090",
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def vector_response(value="1"):
+    """
+    Prometheus instant-vector response with a single sample.
+    """
+    return {
+        "status": "success",
+        "data": {"resultType": "vector", "result": [{"metric": {}, "value": [0, value]}]},
+    }
+
+
+@pytest.mark.asyncio
+async def test_query_reuses_shared_client():
+    """
+    Test that consecutive queries go through one pooled client.
+    """
+    service = PrometheusService()
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=vector_response("42"))
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)) as create:
+        await service.start()
+        first = await service.query("up")
+        second = await service.query('up{job="node"}')
+        await service.close()
+
+    assert create.call_count == 1
+    assert len(requests) == 2
+    assert first["result"][0]["value"][1] == "42"
+    assert second == first
+
+
+@pytest.mark.asyncio
+async def test_query_returns_none_on_error():
+    """
+    Test that upstream failures are reported as a missing result.
+    """
+    service = PrometheusService()
+
+    def handler(request):
+        return httpx.Response(503)
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)):
+        assert await service.query("up") is None
+        await service.close()
+
+
+@pytest.mark.asyncio
+async def test_identical_queries_are_cached_and_coalesced():
+    """
+    Test that concurrent and repeated identical queries hit Prometheus once.
+    """
+    service = PrometheusService()
+    requests = []
+
+    async def fake_request(path, params, timeout=None):
+        requests.append(params)
+        await asyncio.sleep(0.01)
+        return {"result": [{"metric": {}, "value": [params["time"], "7"]}]}
+
+    with patch.object(service, "_request", side_effect=fake_request):
+        results = await asyncio.gather(*(service.query("up") for _ in range(20)))
+        again = await service.query("up")
+
+    assert len(requests) == 1
+    assert requests[0]["time"] % service.cache.ttl == 0
+    assert all(result == results[0] for result in results)
+    assert again == results[0]
+
+
+def test_query_cache_evicts_least_recently_used():
+    """
+    Test that the result cache stays within its entry bound.
+    """
+    cache = QueryCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+@pytest.mark.asyncio
+async def test_get_fleet_metrics_groups_by_instance():
+    """
+    Test that fleet metrics run one query per metric and key results by (job, instance).
+    """
+    service = PrometheusService()
+    queries = []
+
+    def handler(request):
+        queries.append(request.url.params["query"])
+        return httpx.Response(200, json={
+            "status": "success",
+            "data": {
+                "resultType": "vector",
+                "result": [
+                    {"metric": {"job": "node", "instance": "a:9100"}, "value": [0, "10"]},
+                    {"metric": {"job": "node", "instance": "b:9100"}, "value": [0, "20"]},
+                ],
+            },
+        })
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)):
+        fleet, errors = await service.get_fleet_metrics()
+        await service.close()
+
+    assert len(queries) == 5
+    assert all("by (job, instance)" in query for query in queries)
+    assert fleet[("node", "a:9100")]["cpu_usage_percent"] == 10.0
+    assert fleet[("node", "b:9100")]["network_tx_bytes_per_sec"] == 20.0
+    assert errors == {}
+
+
+@pytest.mark.asyncio
+async def test_get_server_metrics_returns_partial_results():
+    """
+    Test that slow and failing metric queries don't hold back the others.
+    """
+    service = PrometheusService()
+
+    async def handler(request):
+        query = request.url.params["query"]
+        if "node_filesystem" in query:
+            await asyncio.sleep(0.3)
+        if "node_memory" in query:
+            return httpx.Response(500)
+        return httpx.Response(200, json=vector_response("5"))
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)), \
+            patch.object(settings, "PROMETHEUS_METRICS_DEADLINE_SECONDS", 0.1):
+        metrics, errors = await service.get_server_metrics("node", "a:9100")
+
+    assert metrics["cpu_usage_percent"] == 5.0
+    assert set(metrics) == {"cpu_usage_percent", "network_rx_bytes_per_sec", "network_tx_bytes_per_sec"}
+    assert errors == {"disk_usage_percent": "timeout", "memory_usage_percent": "error"}
+
+    # Let the abandoned query finish before the event loop closes
+    await asyncio.sleep(0.3)
+    await service.close()
+
+
+def test_compute_step_respects_max_points():
+    """
+    Test that the range step keeps every window within max_points samples.
+    """
+    for window in (60, 3600, 6 * 3600, 30 * 86400):
+        step = compute_step(0, window, 500)
+        assert window // step + 1 <= 500
+        assert step >= settings.PROMETHEUS_SCRAPE_INTERVAL_SECONDS
+
+
+def fake_series(start, end, step, job="node"):
+    """
+    Columnar series whose value is derived from the timestamp.
+    """
+    values = []
+    ts = start
+    while ts <= end:
+        values.append([ts, str(ts % 97)])
+        ts += step
+    return SeriesColumns.from_samples({"job": job}, values)
+
+
+@pytest.mark.asyncio
+async def test_range_cache_only_fetches_missing_tail():
+    """
+    Test that repeating a "last 6h" query only asks Prometheus for the newest block.
+    """
+    cache = RangeCache(MemoryBlockStore(max_bytes=10 * 1024 * 1024), block_seconds=3600, freshness_seconds=60)
+    fetches = []
+
+    async def fetch(query, start, end, step):
+        fetches.append((start, end))
+        return [fake_series(start, end, step)]
+
+    now = int(time.time())
+    step = 15
+    first = await cache.query("up", now - 6 * 3600, now, step, fetch)
+    assert len(fetches) == 1
+
+    fetches.clear()
+    second = await cache.query("up", now - 6 * 3600, now, step, fetch)
+    assert len(fetches) == 1
+    assert fetches[0][0] >= now - 2 * 3600 - 60
+
+    aligned_start = (now - 6 * 3600) // step * step
+    aligned_end = now // step * step
+    expected = [fake_series(aligned_start, aligned_end, step)]
+    assert first == expected
+    assert second == expected
+
+
+@pytest.mark.asyncio
+async def test_range_cache_stores_whole_blocks_of_past_windows():
+    """
+    Test that a past window ending mid-block caches that block in full, so wider queries see no gap.
+    """
+    cache = RangeCache(MemoryBlockStore(max_bytes=10 * 1024 * 1024), block_seconds=3600, freshness_seconds=60)
+    fetches = []
+
+    async def fetch(query, start, end, step):
+        fetches.append((start, end))
+        return [fake_series(start, end, step)]
+
+    step = 60
+    base = (int(time.time()) - 3 * 86400) // 3600 * 3600
+    assert await cache.query("up", base, base + 1800, step, fetch) == [fake_series(base, base + 1800, step)]
+    assert fetches == [(base, base + 3600 - step)]
+
+    fetches.clear()
+    wider = await cache.query("up", base, base + 7200, step, fetch)
+    assert fetches == [(base + 3600, base + 3 * 3600 - step)]
+    assert wider == [fake_series(base, base + 7200, step)]
+    assert len(wider[0]) == 121
+
+
+@pytest.mark.asyncio
+async def test_memory_block_store_respects_budget():
+    """
+    Test that the in-process block store evicts old blocks beyond its memory budget.
+    """
+    store = MemoryBlockStore(max_bytes=200)
+    block = {"k": fake_series(0, 90, 15)}
+    await store.set_many({"a": block, "b": block, "c": block})
+
+    assert store.size_bytes <= 200
+    assert (await store.get_many(["a"]))[0] is None
+    assert (await store.get_many(["c"]))[0] == block
+
+
+def test_series_columns_slice_and_round_trip():
+    """
+    Test slicing columnar series by time and their msgpack byte form used by the Redis block store.
+    """
+    series = fake_series(0, 300, 15)
+
+    part = series.slice_time(60, 120)
+    assert list(part.timestamps) == [60, 75, 90, 105]
+    assert SeriesColumns.from_msgpack_dict(series.to_msgpack_dict()) == series
+
+
+@pytest.mark.asyncio
+async def test_sharded_range_query_matches_unsharded():
+    """
+    Test that long range queries are split into shards and merged losslessly.
+    """
+    service = PrometheusService()
+    requests = []
+
+    async def fake_fetch_series(path, params, timeout=None):
+        requests.append(params)
+        return [
+            fake_series(params["start"], params["end"], params["step"]),
+            fake_series(params["start"], params["end"], params["step"], job="other"),
+        ]
+
+    start, end, step = 0, 3 * 86400 + 3600, 60
+    with patch.object(service, "_fetch_series", side_effect=fake_fetch_series):
+        with patch.object(settings, "PROMQL_RANGE_SHARD_SECONDS", 0):
+            unsharded = await service._fetch_range("up", start, end, step)
+        assert len(requests) == 1
+
+        requests.clear()
+        with patch.object(settings, "PROMQL_RANGE_SHARD_SECONDS", 86400):
+            sharded = await service._fetch_range("up", start, end, step)
+
+    assert len(requests) == 4
+    assert sharded == unsharded
+    assert len(sharded[0]) == (end - start) // step + 1
+
+
+@pytest.mark.asyncio
+async def test_oversized_response_is_rejected():
+    """
+    Test that responses above the size guard fail instead of being buffered.
+    """
+    service = PrometheusService()
+
+    def handler(request):
+        return httpx.Response(200, json=vector_response("1" * 1000))
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)), \
+            patch.object(settings, "PROMETHEUS_MAX_RESPONSE_BYTES", 100):
+        assert await service.query("up") is None
+        await service.close()
+
+
+def test_stream_parser_yields_series_incrementally():
+    """
+    Test that result series are returned as soon as each one is complete.
+    """
+    body = json.dumps({
+        "status": "success",
+        "data": {
+            "resultType": "matrix",
+            "result": [
+                {"metric": {"name": 'quoted "]}'}, "values": [[1, "1"]]},
+                {"metric": {"name": "b"}, "values": [[1, "2"], [2, "3"]]},
+            ],
+        },
+    }).encode()
+    parser = ResultStreamParser()
+
+    split = body.index(b'{"metric": {"name": "b"}')
+    first = parser.feed(body[:split])
+    rest = []
+    for offset in range(split, len(body), 7):
+        rest += parser.feed(body[offset:offset + 7])
+    rest += parser.finish()
+
+    assert [item["metric"]["name"] for item in first] == ['quoted "]}']
+    assert [item["metric"]["name"] for item in rest] == ["b"]
+    assert parser.envelope == {"status": "success", "data": {"resultType": "matrix", "result": []}}
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_serves_last_known_value():
+    """
+    Test that an open breaker fails fast and falls back to the last known result.
+    """
+    service = PrometheusService()
+    service.cache.ttl = 0
+    calls = []
+    healthy = True
+
+    def handler(request):
+        calls.append(request)
+        if healthy:
+            return httpx.Response(200, json=vector_response("3"))
+        return httpx.Response(503)
+
+    with patch.object(service, "_create_client", side_effect=lambda: make_client(handler)):
+        assert (await service.query("up"))["result"][0]["value"][1] == "3"
+
+        healthy = False
+        for _ in range(settings.PROMETHEUS_BREAKER_FAILURE_THRESHOLD):
+            await service.query("up")
+        assert service.breaker.state == "open"
+
+        calls.clear()
+        fallback = await service.query("up")
+        assert calls == []
+        assert fallback["result"][0]["value"][1] == "3"
+        assert await service.query("other") is None
+        await service.close()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_backs_off_on_slow_requests():
+    """
+    Test that the concurrency limit grows on fast requests, shrinks on slow ones
+    and queues requests above it.
+    """
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=10, latency_target=1.0)
+
+    await limiter.acquire()
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    limiter.release(latency=0.1, ok=True)
+    await asyncio.sleep(0)
+    assert waiter.done()
+    assert limiter.limit == 2.5
+
+    limiter.release(latency=5.0, ok=True)
+    limiter.release(latency=0.1, ok=False)
+    assert limiter.limit < 2.5
+    assert limiter.inflight == 0
@@ -1,4 +1,5 @@
 import pytest
+from unittest.mock import patch
 from fastapi import status
 from ..models import Server
 
@@ -110,6 +111,20 @@ def test_update_server(client, auth_headers, test_server):
     assert data["is_active"] == update_data["is_active"]
 
 
+@patch("app.api.v1.endpoints.servers.server_registry.invalidate")
+def test_update_server_invalidates_registry(mock_invalidate, client, auth_headers, test_server):
+    """
+    Test that updating a server drops its cached metadata used by live streams.
+    """
+    response = client.patch(
+        f"/api/v1/servers/{test_server.id}",
+        json={"instance": "moved:9100"},
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    mock_invalidate.assert_called_once_with(test_server.id)
+
+
 def test_update_server_not_found(client, auth_headers):
     """
     Test updating a non-existent server.
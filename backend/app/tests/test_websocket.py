@@ -0,0 +1,480 @@
+import asyncio
+import time
+import msgpack
+import pytest
+from datetime import datetime
+from unittest.mock import patch, AsyncMock, MagicMock
+from prometheus_client import REGISTRY
+from ..services.fanout import RELEASE_SCRIPT, RedisFanout
+from ..services.delta_encoder import DELTA_SUBPROTOCOL, DeltaEncoder
+from ..services.recent_samples import RecentSamples
+from ..services.metrics_hub import MetricsHub, SlowConsumer, Subscriber, metrics_hub
+from ..services.server_registry import ServerInfo, ServerRegistry, server_registry
+from ..main import _send
+
+
+def make_server(server_id=1, instance="localhost:9100", is_active=True):
+    """
+    Build server metadata for hub tests.
+    """
+    return ServerInfo(server_id, f"Server {server_id}", "node", instance, is_active)
+
+
+def iso(timestamp):
+    """
+    Snapshot timestamp (naive UTC ISO) for a unix time.
+    """
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+def registry_with(servers):
+    """
+    Serve the given servers from the shared registry instead of the database.
+    """
+    server_registry.invalidate()
+    return patch.object(
+        server_registry,
+        "_load",
+        side_effect=lambda server_ids: [server for server in servers if server.id in server_ids],
+    )
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = set()
+        self.messages = asyncio.Queue()
+        redis.pubsubs.append(self)
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    async def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.redis.pubsubs.remove(self)
+
+
+class FakeRedis:
+    """
+    Just enough of redis.asyncio for the metrics fanout.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.pubsubs = []
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token, *args):
+        if self.values.get(key) != token:
+            return 0
+        if script == RELEASE_SCRIPT:
+            del self.values[key]
+        return 1
+
+    async def publish(self, channel, message):
+        receivers = [pubsub for pubsub in self.pubsubs if channel in pubsub.channels]
+        for pubsub in receivers:
+            pubsub.messages.put_nowait({"type": "message", "channel": channel.encode(), "data": message.encode()})
+        return len(receivers)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.mark.asyncio
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+async def test_hub_runs_one_poller_per_server(mock_get_metrics):
+    """
+    Test that many subscribers of one server share a single poller.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    hub = MetricsHub(interval=60)
+    server = make_server()
+
+    subscribers = [Subscriber() for _ in range(50)]
+    for subscriber in subscribers:
+        hub.subscribe(server, subscriber)
+    await asyncio.wait_for(asyncio.gather(*(subscriber.wait() for subscriber in subscribers)), 1)
+    snapshots = [subscriber.drain()[0] for subscriber in subscribers]
+
+    assert mock_get_metrics.await_count == 1
+    assert all(snapshot["metrics"] == {"cpu_usage_percent": 12.0} for snapshot in snapshots)
+    assert hub.subscriber_count(server.id) == 50
+    assert hub.polled_servers == {server.id}
+
+    for subscriber in subscribers:
+        hub.unsubscribe(server.id, subscriber)
+    assert hub.subscriber_count(server.id) == 0
+    assert hub.polled_servers == set()
+
+    await hub.close()
+
+
+@pytest.mark.asyncio
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+async def test_hub_batches_servers_once_per_tick(mock_get_metrics):
+    """
+    Test that snapshots of several servers arrive in one batch per interval.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    hub = MetricsHub(interval=0.5)
+    subscriber = Subscriber()
+    for server_id in range(1, 11):
+        hub.subscribe(make_server(server_id, f"host{server_id}:9100"), subscriber)
+
+    batch = await asyncio.wait_for(hub.next_batch(subscriber, 0.05), 2)
+    first_tick = subscriber.last_tick
+    assert sorted(snapshot["server_id"] for snapshot in batch) == list(range(1, 11))
+
+    await asyncio.wait_for(hub.next_batch(subscriber, 0.05), 2)
+    assert subscriber.last_tick > first_tick
+
+    hub.unsubscribe_all(subscriber)
+    assert hub.polled_servers == set()
+    await hub.close()
+
+
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+def test_multiplexed_websocket(mock_get_metrics, client):
+    """
+    Test subscribing to several servers over one multiplexed socket.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    servers = [make_server(1), make_server(2, "host2:9100")]
+
+    with registry_with(servers), \
+            patch.object(metrics_hub, "interval", 0.2), \
+            patch("app.main.settings.WS_BATCH_WINDOW_SECONDS", 0.05):
+        with client.websocket_connect("/ws/metrics") as websocket:
+            websocket.send_json({"action": "subscribe", "server_ids": [1, 2, 3]})
+            assert websocket.receive_json() == {
+                "type": "error",
+                "error": "Server not found or not active",
+                "server_ids": [3],
+            }
+            assert websocket.receive_json() == {"type": "subscribed", "server_ids": [1, 2]}
+            assert websocket.receive_json()["type"] == "backfill"
+
+            frame = websocket.receive_json()
+            assert frame["type"] == "metrics"
+            assert sorted(snapshot["server_id"] for snapshot in frame["servers"]) == [1, 2]
+
+            websocket.send_json({"action": "rename", "server_ids": [1]})
+            reply = websocket.receive_json()
+            while reply["type"] == "metrics":
+                reply = websocket.receive_json()
+            assert reply["type"] == "error"
+
+
+def test_delta_encoder_sends_changed_fields():
+    """
+    Test that only metrics moving past epsilon are re-sent after the first snapshot.
+    """
+    encoder = DeltaEncoder(epsilon=0.5)
+    snapshot = {
+        "server_id": 1,
+        "server_name": "Server 1",
+        "timestamp": "2024-01-01T00:00:00",
+        "metrics": {"cpu_usage_percent": 10.0, "memory_usage_percent": 50.0},
+        "errors": {},
+    }
+
+    first = encoder.encode(snapshot)
+    assert first["full"] is True
+    assert first["timestamp"] == 1704067200.0
+    assert first["metrics"] == snapshot["metrics"]
+
+    second = encoder.encode(dict(snapshot, metrics={"cpu_usage_percent": 10.4, "memory_usage_percent": 51.0}))
+    assert second == {"server_id": 1, "timestamp": 1704067200.0, "metrics": {"memory_usage_percent": 51.0}}
+
+    # Drift is measured against the last value sent, not the last one seen
+    third = encoder.encode(dict(snapshot, metrics={"cpu_usage_percent": 10.8, "memory_usage_percent": 51.0}))
+    assert third["metrics"] == {"cpu_usage_percent": 10.8}
+
+    fourth = encoder.encode(dict(
+        snapshot,
+        metrics={"cpu_usage_percent": 10.8},
+        errors={"memory_usage_percent": "timeout"},
+    ))
+    assert "metrics" not in fourth
+    assert fourth["removed"] == ["memory_usage_percent"]
+    assert fourth["errors"] == {"memory_usage_percent": "timeout"}
+
+    encoder.forget(1)
+    assert encoder.encode(snapshot)["full"] is True
+
+
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+def test_multiplexed_websocket_delta_protocol(mock_get_metrics, client):
+    """
+    Test that the delta subprotocol switches the socket to msgpack delta frames.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+
+    with registry_with([make_server(1)]), \
+            patch.object(metrics_hub, "interval", 0.2), \
+            patch("app.main.settings.WS_BATCH_WINDOW_SECONDS", 0.05):
+        with client.websocket_connect("/ws/metrics", subprotocols=[DELTA_SUBPROTOCOL]) as websocket:
+            assert websocket.accepted_subprotocol == DELTA_SUBPROTOCOL
+            websocket.send_json({"action": "subscribe", "server_ids": [1]})
+            assert msgpack.unpackb(websocket.receive_bytes()) == {"type": "subscribed", "server_ids": [1]}
+            assert msgpack.unpackb(websocket.receive_bytes())["type"] == "backfill"
+
+            first = msgpack.unpackb(websocket.receive_bytes())
+            assert first["servers"][0]["full"] is True
+            assert first["servers"][0]["metrics"] == {"cpu_usage_percent": 12.0}
+
+            second = msgpack.unpackb(websocket.receive_bytes())
+            assert second["servers"][0]["server_id"] == 1
+            assert "metrics" not in second["servers"][0]
+
+
+def test_subscriber_keeps_latest_snapshot_per_server():
+    """
+    Test that a lagging subscriber coalesces snapshots instead of queueing them.
+    """
+    dropped = REGISTRY.get_sample_value("vigil_ws_dropped_snapshots_total")
+    pending = REGISTRY.get_sample_value("vigil_ws_pending_snapshots")
+    subscriber = Subscriber()
+    subscriber.server_ids.update({1, 2})
+
+    for tick in range(100):
+        subscriber.deliver(1, {"server_id": 1, "tick": tick})
+        subscriber.deliver(2, {"server_id": 2, "tick": tick})
+    subscriber.deliver(3, {"server_id": 3, "tick": 0})
+
+    assert REGISTRY.get_sample_value("vigil_ws_pending_snapshots") == pending + 2
+    assert REGISTRY.get_sample_value("vigil_ws_dropped_snapshots_total") == dropped + 198
+    assert subscriber.drain() == [{"server_id": 1, "tick": 99}, {"server_id": 2, "tick": 99}]
+    assert REGISTRY.get_sample_value("vigil_ws_pending_snapshots") == pending
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_disconnected():
+    """
+    Test that a send blocked past the threshold raises SlowConsumer.
+    """
+    disconnects = REGISTRY.get_sample_value("vigil_ws_slow_consumer_disconnects_total")
+
+    async def blocked_send(frame):
+        await asyncio.sleep(10)
+
+    websocket = MagicMock()
+    websocket.send_json = blocked_send
+
+    with patch("app.main.settings.WS_SLOW_CONSUMER_SECONDS", 0.05):
+        with pytest.raises(SlowConsumer):
+            await _send(websocket, {"type": "metrics", "servers": []}, None)
+
+    assert REGISTRY.get_sample_value("vigil_ws_slow_consumer_disconnects_total") == disconnects + 1
+
+
+@pytest.mark.asyncio
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+async def test_redis_fanout_polls_once_across_processes(mock_get_metrics):
+    """
+    Test that only the lease holder polls while every process relays its snapshots.
+    """
+    async def get_metrics(job_name, instance):
+        # Give every process time to start relaying before the first publish
+        await asyncio.sleep(0.05)
+        return {"cpu_usage_percent": 12.0}, {}
+
+    mock_get_metrics.side_effect = get_metrics
+    redis = FakeRedis()
+    hubs = []
+    for _ in range(3):
+        fanout = RedisFanout("redis://localhost:6379/0", lease_seconds=180)
+        fanout._redis = redis
+        hubs.append(MetricsHub(interval=60, fanout=fanout))
+
+    server = make_server()
+    subscribers = [Subscriber() for _ in hubs]
+    for hub, subscriber in zip(hubs, subscribers):
+        hub.subscribe(server, subscriber)
+    await asyncio.wait_for(asyncio.gather(*(subscriber.wait() for subscriber in subscribers)), 2)
+
+    assert mock_get_metrics.await_count == 1
+    for subscriber in subscribers:
+        assert subscriber.drain()[0]["metrics"] == {"cpu_usage_percent": 12.0}
+    holder = redis.values["vigil:metrics-lease:1"]
+    assert holder in {hub.fanout.token for hub in hubs}
+
+    # The lease is released as soon as the holder stops watching the server
+    for hub, subscriber in zip(hubs, subscribers):
+        if hub.fanout.token == holder:
+            hub.unsubscribe(server.id, subscriber)
+    await asyncio.sleep(0.05)
+    assert "vigil:metrics-lease:1" not in redis.values
+
+    for hub in hubs:
+        await hub.close()
+
+
+@pytest.mark.asyncio
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+async def test_redis_fanout_subscribes_to_watched_servers_only(mock_get_metrics):
+    """
+    Test that each process only receives the channels of servers it has local subscribers for.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    redis = FakeRedis()
+    hubs = []
+    for _ in range(2):
+        fanout = RedisFanout("redis://localhost:6379/0", lease_seconds=180)
+        fanout._redis = redis
+        hubs.append(MetricsHub(interval=60, fanout=fanout))
+
+    first, second = make_server(1), make_server(2)
+    subscribers = [Subscriber(), Subscriber()]
+    hubs[0].subscribe(first, subscribers[0])
+    hubs[1].subscribe(second, subscribers[1])
+    await asyncio.wait_for(asyncio.gather(*(subscriber.wait() for subscriber in subscribers)), 2)
+
+    assert [pubsub.channels for pubsub in redis.pubsubs] == [{"vigil:metrics:1"}, {"vigil:metrics:2"}]
+    assert [[snapshot["server_id"] for snapshot in subscriber.drain()] for subscriber in subscribers] == [[1], [2]]
+
+    hubs[0].unsubscribe(first.id, subscribers[0])
+    await asyncio.sleep(0.05)
+    assert redis.pubsubs[0].channels == set()
+
+    for hub in hubs:
+        await hub.close()
+
+
+def test_recent_samples_ring_wraps():
+    """
+    Test that the ring keeps the newest samples in order once it wraps around.
+    """
+    samples = RecentSamples(window_seconds=20, interval=5)
+    start = int(time.time()) - 25
+    for second in range(0, 30, 5):
+        samples.record({
+            "server_id": 1,
+            "timestamp": iso(start + second),
+            "metrics": {"cpu_usage_percent": float(second), "memory_usage_percent": None},
+        })
+    # A snapshot relayed twice is only stored once
+    samples.record({"server_id": 1, "timestamp": iso(start + 25), "metrics": {"cpu_usage_percent": 1.0}})
+
+    recent = samples.get(1, since=0)
+    assert recent["timestamps"] == [start + 10.0, start + 15.0, start + 20.0, start + 25.0]
+    assert recent["metrics"]["cpu_usage_percent"] == [10.0, 15.0, 20.0, 25.0]
+    assert recent["metrics"]["memory_usage_percent"] == [None] * 4
+
+    assert samples.get(1, since=start + 15.0)["metrics"]["cpu_usage_percent"] == [20.0, 25.0]
+    assert len(samples.get(1, binary=True)["timestamps"]) == 4 * 8
+    assert samples.get(2) == {"server_id": 2, "timestamps": [], "metrics": {}}
+
+
+def test_recent_samples_expire():
+    """
+    Test that samples older than the window are not served and rings of servers no longer fed are dropped.
+    """
+    samples = RecentSamples(window_seconds=60, interval=5)
+    now = int(time.time())
+    samples.record({"server_id": 1, "timestamp": iso(now - 3600), "metrics": {"cpu_usage_percent": 10.0}})
+    samples.record({"server_id": 2, "timestamp": iso(now - 90), "metrics": {"cpu_usage_percent": 20.0}})
+    samples.record({"server_id": 2, "timestamp": iso(now - 30), "metrics": {"cpu_usage_percent": 30.0}})
+
+    assert samples.get(2)["metrics"]["cpu_usage_percent"] == [30.0]
+    samples.prune()
+    assert len(samples) == 1
+    assert samples.get(1)["timestamps"] == []
+
+
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+def test_websocket_sends_backfill_on_connect(mock_get_metrics, client):
+    """
+    Test that a new viewer first receives the recent samples of the server.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    samples = RecentSamples(window_seconds=60, interval=5)
+    now = int(time.time())
+    samples.record({"server_id": 1, "timestamp": iso(now - 3600), "metrics": {"cpu_usage_percent": 5.0}})
+    samples.record({"server_id": 1, "timestamp": iso(now - 10), "metrics": {"cpu_usage_percent": 10.0}})
+
+    with registry_with([make_server(1)]), \
+            patch("app.main.recent_samples", samples):
+        with client.websocket_connect("/ws/metrics") as websocket:
+            websocket.send_json({"action": "subscribe", "server_ids": [1]})
+            assert websocket.receive_json()["type"] == "subscribed"
+            assert websocket.receive_json() == {
+                "type": "backfill",
+                "servers": [{
+                    "server_id": 1,
+                    "timestamps": [now - 10.0],
+                    "metrics": {"cpu_usage_percent": [10.0]},
+                }],
+            }
+
+
+@pytest.mark.asyncio
+async def test_server_registry_caches_until_invalidated():
+    """
+    Test that server metadata is loaded once and reloaded after invalidation.
+    """
+    registry = ServerRegistry(ttl=60)
+    servers = {1: make_server(1)}
+
+    with patch.object(registry, "_load", side_effect=lambda ids: [servers[i] for i in ids if i in servers]) as load:
+        assert (await registry.get_many([1, 2])) == {1: servers[1]}
+        assert await registry.get(1) == servers[1]
+        assert await registry.get(2) is None
+        assert load.call_count == 1
+
+        servers[1] = make_server(1, instance="moved:9100")
+        registry.invalidate(1)
+        assert (await registry.get(1)).instance == "moved:9100"
+        assert load.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch("app.services.metrics_hub.prometheus_service.get_server_metrics", new_callable=AsyncMock)
+async def test_hub_follows_registry_changes(mock_get_metrics):
+    """
+    Test that pollers pick up a new instance and stop polling deactivated servers.
+    """
+    mock_get_metrics.return_value = ({"cpu_usage_percent": 12.0}, {})
+    registry = ServerRegistry(ttl=60)
+    servers = {1: make_server(1)}
+    hub = MetricsHub(interval=0.2, registry=registry)
+    subscriber = Subscriber()
+
+    with patch.object(registry, "_load", side_effect=lambda ids: [servers[i] for i in ids if i in servers]):
+        hub.subscribe(servers[1], subscriber)
+        await asyncio.wait_for(subscriber.wait(), 1)
+        subscriber.drain()
+
+        servers[1] = make_server(1, instance="moved:9100")
+        registry.invalidate(1)
+        await asyncio.wait_for(subscriber.wait(), 1)
+        assert mock_get_metrics.call_args.kwargs["instance"] == "moved:9100"
+        subscriber.drain()
+
+        servers[1] = make_server(1, instance="moved:9100", is_active=False)
+        registry.invalidate(1)
+        await asyncio.sleep(0.5)
+        assert subscriber.drain() == []
+
+    await hub.close()